@@ -0,0 +1,154 @@
+"""各アプリの生成処理のレイテンシ・スループットをモックOllamaに対して計測する
+
+実行例:
+    python benchmarks/bench_generation.py --requests 50 --concurrency 8 --latency 0.2 --tokens-per-second 100
+    python benchmarks/bench_generation.py --api-base http://localhost:11434   # 実サーバーに対して計測
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_ollama import MockOllamaConfig, start_mock_server  # noqa: E402
+from llm_admission import FallbackText  # noqa: E402
+
+
+def percentile(values, p):
+    """線形補間によるパーセンタイル"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def build_scenarios(api_base):
+    """計測対象の生成処理（i番目のリクエスト用の入力を受け取る関数）"""
+    import llm_gateway
+    from english_learning_app import EnglishLearningApp
+    from motivation_app import MotivationApp
+    from research_app import BehaviorChangeResearch
+    from motivation_focus_app import MotivationFocusApp
+    from struction import EnglishLearningUX
+
+    # 応答キャッシュを無効にしたゲートウェイを共通で使う（キャッシュではなく生成経路を測る）
+    gateway = llm_gateway.LLMGateway(api_base=api_base)
+    gateway.cache = None
+    llm_gateway._gateway = gateway
+
+    english, motivation, research, focus, ux = (
+        EnglishLearningApp(), MotivationApp(), BehaviorChangeResearch(), MotivationFocusApp(), EnglishLearningUX()
+    )
+
+    def next_step_guidance(i):
+        # プロフィールが似ているため意味的キャッシュの参照を外す（結果の保存は計測に含める）
+        with gateway.bypass_cache():
+            return focus.generate_next_step_guidance({
+                'age_group': "25-34", 'occupation': "会社員（技術系）", 'interest_level': 1 + i % 10,
+                'dream': f"海外で働く{i}"
+            })
+
+    conditions = ["loss_aversion", "social_proof", "implementation_intention"]
+    return {
+        "generate_learning_plan": lambda i: english.generate_learning_plan({
+            'name': f"user{i}", 'age': 20 + i % 40, 'occupation': "エンジニア",
+            'english_level': "初級", 'goal': "TOEIC 800点", 'interests': ["テクノロジー"]
+        }),
+        "calculate_missed_opportunities": lambda i: motivation.calculate_missed_opportunities({
+            'age': "30代前半", 'occupation': f"会社員（技術系）{i}",
+            'current_situation': "仕事で英語が必要だが避けている"
+        }),
+        "generate_personalized_insight": lambda i: research.generate_personalized_insight(
+            {'age_group': "25-34", 'occupation_category': "技術職", 'motivation_level': 1 + i % 10},
+            conditions[i % len(conditions)]
+        ),
+        "generate_next_step_guidance": next_step_guidance,
+        "EnglishLearningUX.generate_learning_path": lambda i: ux.generate_learning_path({
+            'age': 20 + i % 40, 'occupation': "エンジニア", 'english_level': "初級",
+            'goal': "エンジニアとして成功する", 'interests': ["テクノロジー"]
+        }),
+    }
+
+
+def run_scenario(func, requests, concurrency):
+    """同時実行数を指定してリクエストを流し、各リクエストの所要時間を集計"""
+    latencies = []
+    errors = 0
+
+    def timed(i):
+        start = time.perf_counter()
+        try:
+            result = func(i)
+        except Exception:
+            # 例外で止めずにエラーとして数え、残りのリクエストを計測する
+            result = None
+        elapsed = time.perf_counter() - start
+        failed = result is None or isinstance(result, FallbackText)
+        return elapsed, failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for elapsed, failed in executor.map(timed, range(requests)):
+            latencies.append(elapsed)
+            errors += failed
+    wall = time.perf_counter() - started
+
+    return {
+        'requests': requests,
+        'errors': errors,
+        'error_rate': errors / requests if requests else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'throughput_rps': requests / wall if wall else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成処理のレイテンシ・ベンチマーク")
+    parser.add_argument('--requests', type=int, default=20, help="シナリオごとのリクエスト数")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--scenario', action='append', help="対象シナリオ（複数指定可、省略時はすべて）")
+    parser.add_argument('--api-base', default=None, help="指定するとモックを起動せずこのサーバーに接続")
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--tokens-per-second', type=float, default=0.0)
+    parser.add_argument('--response-tokens', type=int, default=64)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = None
+    api_base = args.api_base
+    if api_base is None:
+        config = MockOllamaConfig(
+            latency=args.latency,
+            tokens_per_second=args.tokens_per_second,
+            response_tokens=args.response_tokens,
+            failure_rate=args.failure_rate,
+            seed=0
+        )
+        server, api_base = start_mock_server(config)
+
+    # アプリが作るSQLiteファイルで実データを汚さないよう一時ディレクトリで実行
+    os.chdir(tempfile.mkdtemp(prefix="bench_generation_"))
+    scenarios = build_scenarios(api_base)
+    selected = args.scenario or list(scenarios)
+
+    print(f"api_base={api_base} requests={args.requests} concurrency={args.concurrency}")
+    print(f"{'scenario':45s} {'p50(ms)':>9s} {'p95(ms)':>9s} {'p99(ms)':>9s} {'req/s':>8s} {'errors':>7s} {'err%':>6s}")
+    for name in selected:
+        stats = run_scenario(scenarios[name], args.requests, args.concurrency)
+        print(f"{name:45s} {stats['p50_ms']:9.1f} {stats['p95_ms']:9.1f} {stats['p99_ms']:9.1f} "
+              f"{stats['throughput_rps']:8.2f} {stats['errors']:7d} {stats['error_rate'] * 100:6.1f}")
+
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
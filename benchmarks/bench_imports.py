@@ -0,0 +1,112 @@
+"""各アプリの起動時の import 時間を `python -X importtime` で計測し、予算を超えたら失敗する
+
+起動時に読み込まないことにしている重いモジュール（litellm・pandas・plotly）が読み込まれた場合も失敗する。
+
+実行例:
+    python benchmarks/bench_imports.py
+    python benchmarks/bench_imports.py --budget-ms 800 --repeat 5 --top 15
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_MODULES = [
+    "english_learning_app",
+    "motivation_app",
+    "motivation_focus_app",
+    "research_app",
+    "struction",
+]
+
+# 最初に使うときまで読み込みを遅らせているモジュール
+DEFERRED_MODULES = ("litellm", "pandas", "plotly")
+
+
+def parse_importtime(stderr):
+    """-X importtime の出力を (モジュール名, 自身のμs, 累積μs, 深さ) のリストに変換"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def measure(module):
+    """新しいプロセスで module を import し、import time の行を返す"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env,
+        # アプリが作るSQLiteファイルで実データを汚さないよう一時ディレクトリで実行
+        cwd=tempfile.mkdtemp(prefix="bench_imports_")
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{module} の import に失敗しました:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def heaviest_children(rows, module):
+    """module が直接 import したモジュールを累積時間の長い順に返す
+
+    -X importtime は読み込みが終わった順に出力するため、module の行の直前にある深さ1以上の行がその配下になる。
+    """
+    index = next(i for i, row in enumerate(rows) if row[0] == module and row[3] == 0)
+    children = []
+    for name, _, cumulative_us, depth in reversed(rows[:index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            children.append((name, cumulative_us))
+    return sorted(children, key=lambda child: child[1], reverse=True)
+
+
+def deferred_imports(rows):
+    """起動時に読み込まれてしまった遅延対象のモジュール"""
+    return sorted({
+        name.split(".")[0] for name, _, _, _ in rows
+        if name.split(".")[0] in DEFERRED_MODULES
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="起動時の import 時間のベンチマーク")
+    parser.add_argument("--module", action="append", help="対象モジュール（複数指定可、省略時はすべてのアプリ）")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（中央値を使う）")
+    parser.add_argument("--budget-ms", type=float, default=1500.0, help="1モジュールあたりの import 時間の上限")
+    parser.add_argument("--top", type=int, default=10, help="表示する重いパッケージの数")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':25s} {'import(ms)':>11s} {'budget(ms)':>11s}  deferred modules loaded")
+    for module in args.module or APP_MODULES:
+        runs = [measure(module) for _ in range(args.repeat)]
+        totals = [next(row[2] for row in rows if row[0] == module and row[3] == 0) / 1000 for rows in runs]
+        total = statistics.median(totals)
+        loaded = deferred_imports(runs[0])
+        print(f"{module:25s} {total:11.1f} {args.budget_ms:11.1f}  {', '.join(loaded) or '-'}")
+
+        if total > args.budget_ms:
+            failures.append(f"{module}: {total:.1f}ms が予算 {args.budget_ms:.1f}ms を超えています")
+        if loaded:
+            failures.append(f"{module}: 起動時に {', '.join(loaded)} を読み込んでいます")
+
+        for name, cumulative_us in heaviest_children(runs[0], module)[:args.top]:
+            print(f"    {name:40s} {cumulative_us / 1000:9.1f}ms")
+
+    if failures:
+        print("\n".join(["", "NG:"] + failures))
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
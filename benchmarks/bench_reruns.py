@@ -0,0 +1,231 @@
+"""Streamlit AppTest で代表的な操作を再現し、操作ごとの再実行コストを計測する
+
+操作ごとに「スクリプト再実行回数・SQL文の数・LLM呼び出し回数・所要時間」を数え、
+保存済みのベースライン（rerun_baseline.json）より回数が増えていれば失敗として終了コード1を返す。
+
+実行例:
+    python benchmarks/bench_reruns.py                    # ベースラインと比較
+    python benchmarks/bench_reruns.py --update-baseline  # 現在の値をベースラインとして保存
+
+ベースラインがない場合は比較できないため、--update-baseline を付けない限り失敗する。
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rerun_baseline.json')
+
+# 回数として比較する項目（所要時間は環境差が大きいので表示のみ）
+COUNTED_METRICS = ('reruns', 'sql', 'llm_calls')
+
+
+class Counters:
+    """計測中の各種カウンター（AppTestのスクリプトとは同一プロセスで共有される）"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.values = {name: 0 for name in COUNTED_METRICS}
+
+    def increment(self, name):
+        with self.lock:
+            self.values[name] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+
+COUNTERS = Counters()
+
+
+def stub_completion(model, messages, api_base=None, stream=False, **params):
+    """litellm.completion の代わりに即座に固定応答を返す"""
+    COUNTERS.increment('llm_calls')
+    text = f"スタブ応答（{len(messages)}件のメッセージ）"
+    if stream:
+        return iter([
+            types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))])
+        ])
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=text))])
+
+
+def install_stubs():
+    """LLM呼び出しをスタブに差し替え、SQL文の数を数えるリスナーを登録"""
+    import database
+    import llm_gateway
+    import metrics
+
+    llm_gateway.completion = stub_completion
+    # リスナーはプロセス全体のSQLを数えるため、操作と無関係に定期実行されるメトリクスの書き出しを止める
+    metrics.get_metrics().db_path = None
+    database.add_statement_listener(lambda sql: COUNTERS.increment('sql'))
+
+
+def app_script(module_name):
+    """AppTestで実行するスクリプト（実行ごとに再実行回数を数えてからアプリのmainを呼ぶ）"""
+    return f"""
+import bench_reruns
+bench_reruns.COUNTERS.increment('reruns')
+import {module_name}
+{module_name}.main()
+"""
+
+
+def button(at, label):
+    """ラベルでボタンを探す"""
+    for candidate in at.button:
+        if candidate.label == label:
+            return candidate
+    raise LookupError(f"button not found: {label}")
+
+
+def flow_motivation_focus(at):
+    """motivation_focus_app: 入力 → 分析 → 結果ページでの再実行"""
+    yield "initial", lambda: at.run()
+    yield "slider", lambda: at.slider[0].set_value(8).run()
+    yield "analyze", lambda: button(at, "🤖 AIに分析してもらう").click().run()
+    yield "rerun_on_results", lambda: at.run()
+
+
+def flow_research(at):
+    """research_app: 同意 → ベースライン → 介入ページのスライダー操作 → 送信"""
+    yield "initial", lambda: at.run()
+    yield "consent", lambda: at.checkbox[0].check().run()
+    yield "join", lambda: button(at, "研究に参加").click().run()
+    yield "baseline_submit", lambda: button(at, "次へ").click().run()
+    yield "intervention_slider_1", lambda: at.slider[0].set_value(7).run()
+    yield "intervention_slider_2", lambda: at.slider[1].set_value(8).run()
+    yield "intervention_slider_3", lambda: at.slider[2].set_value(9).run()
+    yield "submit_results", lambda: button(at, "結果を送信").click().run()
+
+
+def flow_motivation(at):
+    """motivation_app: 診断フォーム送信 → 結果ページでの再実行"""
+    yield "initial", lambda: at.run()
+    yield "assessment_submit", lambda: button(at, "🔍 診断結果を見る").click().run()
+    yield "rerun_on_results", lambda: at.run()
+
+
+def flow_english_learning(at):
+    """english_learning_app: ユーザー登録 → チャット送信 → 再実行"""
+    def register():
+        at.sidebar.text_input[0].input("ベンチ太郎")
+        button(at, "登録する").click().run()
+
+    def chat_send():
+        at.text_input(key="chat_input").input("Hello")
+        button(at, "送信").click().run()
+
+    yield "initial", lambda: at.run()
+    yield "register", register
+    yield "chat_send", chat_send
+    yield "rerun_on_chat", lambda: at.run()
+
+
+FLOWS = {
+    'motivation_focus_app': flow_motivation_focus,
+    'research_app': flow_research,
+    'motivation_app': flow_motivation,
+    'english_learning_app': flow_english_learning,
+}
+
+
+def run_flows(selected):
+    """各フローを実行し、操作ごとの計測値を返す"""
+    from streamlit.testing.v1 import AppTest
+    from research_store import drain_writers
+
+    results = {}
+    for module_name in selected:
+        at = AppTest.from_string(app_script(module_name), default_timeout=60)
+        steps = {}
+        for step, action in FLOWS[module_name](at):
+            COUNTERS.reset()
+            started = time.perf_counter()
+            action()
+            # 書き込みスレッドのSQLを、それを発生させた操作の分として数える
+            drain_writers()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if at.exception:
+                raise RuntimeError(f"{module_name}/{step}: {at.exception}")
+            steps[step] = dict(COUNTERS.snapshot(), wall_ms=round(elapsed_ms, 1))
+        results[module_name] = steps
+    return results
+
+
+def compare(results, baseline):
+    """ベースラインより回数が増えた項目を列挙"""
+    regressions = []
+    for module_name, steps in results.items():
+        for step, values in steps.items():
+            expected = baseline.get(module_name, {}).get(step)
+            if expected is None:
+                continue
+            for metric in COUNTED_METRICS:
+                if values[metric] > expected.get(metric, 0):
+                    regressions.append(
+                        f"{module_name}/{step}: {metric} {expected.get(metric, 0)} -> {values[metric]}"
+                    )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streamlitの再実行コスト・ベンチマーク")
+    parser.add_argument('--flow', action='append', choices=list(FLOWS), help="対象フロー（省略時はすべて）")
+    parser.add_argument('--update-baseline', action='store_true', help="計測値をベースラインとして保存")
+    args = parser.parse_args()
+
+    if not args.update_baseline and not os.path.exists(BASELINE_PATH):
+        sys.exit(f"ベースライン {BASELINE_PATH} がありません（--update-baseline で作成してください）")
+
+    # AppTestのスクリプトから bench_reruns とアプリを import できるようにする
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.modules.setdefault('bench_reruns', sys.modules[__name__])
+
+    # 実データを汚さないよう一時ディレクトリで実行
+    os.chdir(tempfile.mkdtemp(prefix="bench_reruns_"))
+    install_stubs()
+    results = run_flows(args.flow or list(FLOWS))
+
+    print(f"{'flow/step':50s} {'reruns':>7s} {'sql':>6s} {'llm':>5s} {'wall(ms)':>10s}")
+    for module_name, steps in results.items():
+        for step, values in steps.items():
+            print(f"{module_name + '/' + step:50s} {values['reruns']:7d} {values['sql']:6d} "
+                  f"{values['llm_calls']:5d} {values['wall_ms']:10.1f}")
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, encoding='utf-8') as f:
+                baseline = json.load(f)
+        for module_name, steps in results.items():
+            baseline[module_name] = {
+                step: {metric: values[metric] for metric in COUNTED_METRICS}
+                for step, values in steps.items()
+            }
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"baseline saved: {BASELINE_PATH}")
+        return
+
+    with open(BASELINE_PATH, encoding='utf-8') as f:
+        regressions = compare(results, json.load(f))
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Ollama互換のモックサーバー（ベンチマーク・オフライン検証用）
+
+実行例:
+    python benchmarks/mock_ollama.py --port 11435 --latency 0.5 --tokens-per-second 40 --failure-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOllamaConfig:
+    """モックサーバーの挙動設定"""
+
+    def __init__(self, latency=0.0, tokens_per_second=0.0, response_tokens=64,
+                 failure_rate=0.0, model="hf.co/elyza/Llama-3-ELYZA-JP-8B-GGUF", seed=None):
+        # 最初のトークンまでの待ち時間（秒）
+        self.latency = latency
+        # 生成速度（0なら待ち時間なし）
+        self.tokens_per_second = tokens_per_second
+        # 1回の応答で返すトークン数
+        self.response_tokens = response_tokens
+        # 500エラーを返す確率
+        self.failure_rate = failure_rate
+        self.model = model
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+    def should_fail(self):
+        with self.lock:
+            self.request_count += 1
+            return self.random.random() < self.failure_rate
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _tokens(prompt, count):
+    """プロンプトの長さに依存した決定的なダミートークン列"""
+    base = ["英語", "学習", "は", "毎日", "少し", "ずつ", "続ける", "こと", "が", "大切", "です", "。"]
+    offset = len(prompt) % len(base)
+    return [base[(offset + i) % len(base)] for i in range(count)]
+
+
+class MockOllamaHandler(BaseHTTPRequestHandler):
+    """Ollama API の一部（/api/generate, /api/chat, /api/embed, /api/tags）を模倣"""
+
+    config = MockOllamaConfig()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b'{}'
+        return json.loads(body or b'{}')
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') in ('/api/tags', ''):
+            self._send_json(200, {"models": [{"name": self.config.model, "model": self.config.model}]})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        path = self.path.rstrip('/')
+        try:
+            request = self._read_json()
+        except ValueError:
+            self._send_json(400, {"error": "invalid json"})
+            return
+
+        if path in ('/api/embed', '/api/embeddings'):
+            self._handle_embed(request)
+            return
+        if path not in ('/api/generate', '/api/chat'):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        if self.config.should_fail():
+            self._send_json(500, {"error": "injected failure"})
+            return
+
+        if path == '/api/chat':
+            prompt = "".join(m.get('content') or '' for m in request.get('messages', []))
+        else:
+            prompt = request.get('prompt', '')
+        tokens = _tokens(prompt, self.config.response_tokens)
+        stream = request.get('stream', True)
+
+        started = time.perf_counter()
+        time.sleep(self.config.latency)
+        if stream:
+            self._stream(path, request, tokens, started)
+        else:
+            if self.config.tokens_per_second:
+                time.sleep(len(tokens) / self.config.tokens_per_second)
+            self._send_json(200, self._chunk(path, request, "".join(tokens), True, len(prompt), len(tokens), started))
+
+    def _stream(self, path, request, tokens, started):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        delay = 1.0 / self.config.tokens_per_second if self.config.tokens_per_second else 0
+        for token in tokens:
+            if delay:
+                time.sleep(delay)
+            self._write_chunk(self._chunk(path, request, token, False))
+        self._write_chunk(self._chunk(path, request, "", True, len(request.get('prompt', '')), len(tokens), started))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, payload):
+        line = (json.dumps(payload, ensure_ascii=False) + "\n").encode('utf-8')
+        self.wfile.write(f"{len(line):x}\r\n".encode('ascii') + line + b"\r\n")
+        self.wfile.flush()
+
+    def _chunk(self, path, request, text, done, prompt_tokens=0, eval_tokens=0, started=None):
+        payload = {"model": request.get('model', self.config.model), "created_at": _now(), "done": done}
+        if path == '/api/chat':
+            payload["message"] = {"role": "assistant", "content": text}
+        else:
+            payload["response"] = text
+        if done:
+            payload.update({
+                "done_reason": "stop",
+                "total_duration": int((time.perf_counter() - started) * 1e9) if started else 0,
+                "prompt_eval_count": prompt_tokens,
+                "eval_count": eval_tokens,
+            })
+        return payload
+
+    def _handle_embed(self, request):
+        inputs = request.get('input', request.get('prompt', ''))
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        embeddings = []
+        for text in inputs:
+            rng = random.Random(text)
+            embeddings.append([rng.uniform(-1, 1) for _ in range(64)])
+        self._send_json(200, {"model": request.get('model', self.config.model), "embeddings": embeddings,
+                              "embedding": embeddings[0] if embeddings else []})
+
+
+def start_mock_server(config=None, host="127.0.0.1", port=0):
+    """バックグラウンドスレッドでモックサーバーを起動し、(server, api_base) を返す"""
+    handler = type('ConfiguredMockOllamaHandler', (MockOllamaHandler,), {'config': config or MockOllamaConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama互換モックサーバー")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency', type=float, default=0.0, help="最初のトークンまでの秒数")
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help="生成速度（0で待ちなし）")
+    parser.add_argument('--response-tokens', type=int, default=64)
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="500エラーを返す確率（0〜1）")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    config = MockOllamaConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        failure_rate=args.failure_rate,
+        seed=args.seed
+    )
+    handler = type('ConfiguredMockOllamaHandler', (MockOllamaHandler,), {'config': config})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"mock ollama listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
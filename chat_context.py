@@ -0,0 +1,149 @@
+import threading
+import time
+from llm_gateway import token_counter
+from llm_admission import PRIORITY_BULK
+
+
+class ChatContextManager:
+    """チャットのコンテキストを一定量に保つ（直近の会話はそのまま、古い会話は要約）"""
+
+    def __init__(self, app, recent_turns=6, token_budget=3000, summarize_batch_turns=6,
+                 summarize_batch_tokens=2000, summarize_retry_interval=300.0):
+        self.app = app
+        # そのまま送る直近の往復数
+        self.recent_turns = recent_turns
+        # プロンプト全体のトークン上限
+        self.token_budget = token_budget
+        # 要約に回す未要約メッセージがこの往復数たまったら、この往復数ずつ要約に統合する
+        self.summarize_batch_turns = summarize_batch_turns
+        # 1回の要約に含める会話のトークン数の上限
+        self.summarize_batch_tokens = summarize_batch_tokens
+        # 要約に失敗したユーザーは、この秒数が過ぎるまで要約を再試行しない
+        self.summarize_retry_interval = summarize_retry_interval
+        self._failed_at = {}
+        self._folding = set()
+        # 直前の build_messages で未要約のメッセージが1バッチ分以上あったユーザー
+        self._fold_due = set()
+        self._lock = threading.Lock()
+
+    def count_tokens(self, messages):
+        """モデルのトークナイザーでトークン数を数える"""
+        return token_counter(model=self.app.model, messages=messages)
+
+    def build_messages(self, user_id, user_input):
+        """要約＋直近の会話＋新しい入力からLLMへのメッセージを組み立てる（要約の更新は待たない）"""
+        recent = self.app.get_chat_history(user_id, limit=self.recent_turns * 2)
+        summary, summarized_id = self.app.get_chat_summary(user_id)
+
+        # 要約にも直近にも入っていないメッセージ（直前の1バッチ分まで、それより古いものは要約への統合を待つ）
+        first_recent_id = recent[0][0] if recent else None
+        pending = []
+        if first_recent_id is not None:
+            pending = self.app.get_chat_history(
+                user_id, before_id=first_recent_id, limit=self.summarize_batch_turns * 2
+            )
+            pending = [row for row in pending if row[0] > summarized_id]
+            if len(pending) >= self.summarize_batch_turns * 2:
+                with self._lock:
+                    self._fold_due.add(user_id)
+
+        history = [{"role": role, "content": content} for _, role, content, _ in pending + recent]
+        new_message = {"role": "user", "content": user_input}
+
+        # トークン上限を超える場合は古いメッセージから外す（各メッセージは1回だけ数える）
+        sizes = [self.count_tokens([message]) for message in history]
+        total = self.count_tokens(self._assemble(summary, [], new_message)) + sum(sizes)
+        start = 0
+        while start < len(history) and total > self.token_budget:
+            total -= sizes[start]
+            start += 1
+        return self._assemble(summary, history[start:], new_message)
+
+    def fold_pending_in_background(self, user_id):
+        """要約に回すメッセージがたまっていれば別スレッドで要約に統合する（応答の保存後に呼ぶ）"""
+        with self._lock:
+            # たまっていなければスレッドもSQLも使わない
+            if user_id not in self._fold_due or user_id in self._folding:
+                return
+            self._fold_due.discard(user_id)
+            self._folding.add(user_id)
+
+        def run():
+            try:
+                self.fold_pending(user_id)
+            finally:
+                with self._lock:
+                    self._folding.discard(user_id)
+
+        threading.Thread(target=run, name='chat-summary', daemon=True).start()
+
+    def fold_pending(self, user_id):
+        """直近の会話より古い未要約のメッセージを、1バッチずつ要約に統合する"""
+        batch_size = self.summarize_batch_turns * 2
+        # 画面からの生成より後に回す
+        with self.app.llm.prioritized(PRIORITY_BULK):
+            while not self._backing_off(user_id):
+                recent = self.app.get_chat_history(user_id, limit=self.recent_turns * 2)
+                if not recent:
+                    return
+                summary, summarized_id = self.app.get_chat_summary(user_id)
+                batch = self.app.get_chat_history(
+                    user_id, after_id=summarized_id, before_id=recent[0][0], limit=batch_size
+                )
+                if len(batch) < batch_size:
+                    return
+                self.update_summary(user_id, summary, summarized_id, batch)
+
+    def update_summary(self, user_id, summary, summarized_id, rows):
+        """未要約のメッセージを古い順にトークン数の上限まで既存の要約に統合して保存（要約と要約済みの最後のIDを返す）"""
+        batch = []
+        total = 0
+        for row in rows:
+            tokens = self.count_tokens([{"role": row[1], "content": row[2]}])
+            if batch and total + tokens > self.summarize_batch_tokens:
+                break
+            batch.append(row)
+            total += tokens
+
+        conversation = "\n".join(
+            f"{'ユーザー' if role == 'user' else 'アシスタント'}: {content}"
+            for _, role, content, _ in batch
+        )
+        prompt = f"""
+        以下の「これまでの要約」と「続きの会話」を統合し、今後の会話に必要な情報（ユーザーの目標、状況、話題、約束したこと）を残した簡潔な要約を日本語で作成してください。
+        要約のみを出力してください。
+
+        これまでの要約:
+        {summary or 'なし'}
+
+        続きの会話:
+        {conversation}
+        """
+        try:
+            new_summary = self.app.llm.complete(
+                [{"role": "user", "content": prompt}]
+            )
+        except Exception:
+            # 要約に失敗した場合は既存の要約のまま続ける（summarize_retry_interval 秒後に再試行）
+            with self._lock:
+                self._failed_at[user_id] = time.monotonic()
+            return summary, summarized_id
+
+        with self._lock:
+            self._failed_at.pop(user_id, None)
+        self.app.save_chat_summary(user_id, new_summary, batch[-1][0])
+        return new_summary, batch[-1][0]
+
+    def _backing_off(self, user_id):
+        """直近に要約に失敗していて再試行を待っているか"""
+        with self._lock:
+            failed_at = self._failed_at.get(user_id)
+        return failed_at is not None and time.monotonic() - failed_at < self.summarize_retry_interval
+
+    @staticmethod
+    def _assemble(summary, history, new_message):
+        """メッセージ列を組み立てる"""
+        messages = []
+        if summary:
+            messages.append({"role": "system", "content": f"これまでの会話の要約:\n{summary}"})
+        return messages + history + [new_message]
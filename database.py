@@ -0,0 +1,167 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from metrics import span
+
+# 全接続に適用するPRAGMA
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+    "PRAGMA temp_store = MEMORY",
+)
+
+# 接続ごとに保持するプリペアドステートメント数
+STATEMENT_CACHE_SIZE = 128
+
+# 実行されたSQL文を受け取るコールバック（計測用）
+_statement_listeners = []
+
+
+def add_statement_listener(callback):
+    """実行されるSQL文ごとに callback(sql) を呼ぶ"""
+    _statement_listeners.append(callback)
+
+
+def remove_statement_listener(callback):
+    """SQL文のコールバックを解除"""
+    if callback in _statement_listeners:
+        _statement_listeners.remove(callback)
+
+
+def _notify_statement(sql):
+    for callback in list(_statement_listeners):
+        callback(sql)
+
+
+class ConnectionPool:
+    """SQLiteファイルごとの接続プール（スレッドごとに1接続を貸し出す）"""
+
+    def __init__(self, db_path, max_idle=8, busy_timeout=30.0):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.busy_timeout = busy_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self):
+        """新しい接続を作成しPRAGMAを設定"""
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """接続を借りる（同じスレッド内の入れ子呼び出しでは同じ接続を使う）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+
+        # 計測中のみトレースを有効にする（通常時のオーバーヘッドを避ける）
+        conn.set_trace_callback(_notify_statement if _statement_listeners else None)
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """トランザクション内で接続を使う（正常終了でコミット、例外でロールバック）"""
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            with conn:
+                yield conn
+
+    def close_all(self):
+        """待機中の接続をすべて閉じる"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path):
+    """データベースファイルに対応するプロセス共通のプールを取得"""
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path)
+                _pools[db_path] = pool
+    return pool
+
+
+def _db_span(db_path, operation):
+    """DB操作の計測スパン"""
+    return span('db', db=os.path.basename(db_path), operation=operation)
+
+
+@contextmanager
+def transaction(db_path):
+    """トランザクションを開始"""
+    with _db_span(db_path, 'transaction'):
+        with get_pool(db_path).transaction() as conn:
+            yield conn
+
+
+def execute(db_path, sql, params=()):
+    """1文を実行してコミットし、lastrowidを返す"""
+    with _db_span(db_path, 'execute'):
+        with get_pool(db_path).transaction() as conn:
+            return conn.execute(sql, params).lastrowid
+
+
+def executemany(db_path, sql, rows):
+    """複数行をまとめて実行してコミットし、件数を返す"""
+    with _db_span(db_path, 'executemany') as s:
+        with get_pool(db_path).transaction() as conn:
+            rowcount = conn.executemany(sql, rows).rowcount
+        s.set(rows=rowcount)
+        return rowcount
+
+
+def fetch_all(db_path, sql, params=()):
+    """SELECT結果をすべて取得"""
+    with _db_span(db_path, 'fetch_all') as s:
+        with get_pool(db_path).connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        s.set(rows=len(rows))
+        return rows
+
+
+def fetch_one(db_path, sql, params=()):
+    """SELECT結果を1行取得"""
+    with _db_span(db_path, 'fetch_one'):
+        with get_pool(db_path).connection() as conn:
+            return conn.execute(sql, params).fetchone()
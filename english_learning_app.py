@@ -1,69 +1,29 @@
 import streamlit as st
 import json
-import sqlite3
 from datetime import datetime
-from litellm import completion
-import pandas as pd
-import plotly.express as px
+from llm_gateway import get_gateway
+from llm_admission import FallbackText, PRIORITY_CHAT
+from llm_resilience import fallback_text
+from metrics import traced
+from database import execute, fetch_all, fetch_one
+from migrations import run_migrations
+from chat_context import ChatContextManager
+from generation_memo import queue_status, stream_to_placeholder
 
 class EnglishLearningApp:
     def __init__(self):
-        self.model = "ollama/hf.co/elyza/Llama-3-ELYZA-JP-8B-GGUF"
-        self.api_base = "http://localhost:11434"
+        self.llm = get_gateway()
+        self.model = self.llm.model
+        self.db_path = 'english_learning.db'
         self.init_database()
     
     def init_database(self):
-        """データベースの初期化"""
-        conn = sqlite3.connect('english_learning.db')
-        cursor = conn.cursor()
-        
-        # ユーザー情報テーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                age INTEGER,
-                occupation TEXT,
-                english_level TEXT,
-                goal TEXT,
-                interests TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # チャット履歴テーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        # 学習進捗テーブル
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS learning_progress (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                activity TEXT,
-                progress_score INTEGER,
-                date DATE,
-                FOREIGN KEY (user_id) REFERENCES users (id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """データベースの初期化（未適用のマイグレーションのみ実行）"""
+        run_migrations(self.db_path, 'english_learning')
     
     def save_user_info(self, user_info):
         """ユーザー情報をデータベースに保存"""
-        conn = sqlite3.connect('english_learning.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        return execute(self.db_path, '''
             INSERT INTO users (name, age, occupation, english_level, goal, interests)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (
@@ -74,51 +34,70 @@ class EnglishLearningApp:
             user_info['goal'],
             json.dumps(user_info['interests'])
         ))
-        
-        user_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return user_id
     
     def save_chat_message(self, user_id, role, content):
         """チャットメッセージをデータベースに保存"""
-        conn = sqlite3.connect('english_learning.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        execute(self.db_path, '''
             INSERT INTO chat_history (user_id, role, content)
             VALUES (?, ?, ?)
         ''', (user_id, role, content))
-        
-        conn.commit()
-        conn.close()
     
-    def get_chat_history(self, user_id):
-        """チャット履歴を取得"""
-        conn = sqlite3.connect('english_learning.db')
-        cursor = conn.cursor()
+    def get_chat_history(self, user_id, before_id=None, after_id=None, limit=None):
+        """チャット履歴を取得（idによるキーセットページング、古い順で返す）"""
+        upper = before_id if before_id is not None else 2 ** 63 - 1
+        limit = limit if limit is not None else -1
         
-        cursor.execute('''
-            SELECT role, content, timestamp FROM chat_history
-            WHERE user_id = ?
-            ORDER BY timestamp ASC
-        ''', (user_id,))
+        if after_id is not None:
+            # 既に読み込んだ位置より新しいメッセージ
+            return fetch_all(self.db_path, '''
+                SELECT id, role, content, timestamp FROM chat_history
+                WHERE user_id = ? AND id > ? AND id < ?
+                ORDER BY id ASC
+                LIMIT ?
+            ''', (user_id, after_id, upper, limit))
         
-        history = cursor.fetchall()
-        conn.close()
-        return history
+        # 最新（または before_id より前）から limit 件を取得して古い順に並べ直す
+        rows = fetch_all(self.db_path, '''
+            SELECT id, role, content, timestamp FROM chat_history
+            WHERE user_id = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (user_id, upper, limit))
+        rows.reverse()
+        return rows
+    
+    def get_chat_summary(self, user_id):
+        """会話の要約と、要約済みの最後のメッセージIDを取得"""
+        row = fetch_one(self.db_path, '''
+            SELECT summary, last_message_id FROM chat_summaries WHERE user_id = ?
+        ''', (user_id,))
+        return row if row else ('', 0)
+    
+    def save_chat_summary(self, user_id, summary, last_message_id):
+        """会話の要約を保存"""
+        execute(self.db_path, '''
+            INSERT INTO chat_summaries (user_id, summary, last_message_id, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+                summary = excluded.summary,
+                last_message_id = excluded.last_message_id,
+                updated_at = excluded.updated_at
+        ''', (user_id, summary, last_message_id))
     
     def get_llm_response(self, messages):
         """LLMからの応答を取得"""
         try:
-            response = completion(
-                model=self.model,
-                messages=messages,
-                api_base=self.api_base
-            )
-            return response.choices[0].message.content
+            return self.llm.complete(messages)
         except Exception as e:
-            return f"エラーが発生しました: {str(e)}"
+            # エラー内容を応答として扱わず、定型文を返す
+            return fallback_text(e)
+    
+    def stream_llm_response(self, messages):
+        """LLMからの応答をストリーミングで取得"""
+        try:
+            yield from self.llm.stream(messages)
+        except Exception as e:
+            yield fallback_text(e)
     
     def generate_learning_plan(self, user_info):
         """学習計画を生成"""
@@ -144,6 +123,42 @@ class EnglishLearningApp:
         
         return self.get_llm_response([{"role": "user", "content": prompt}])
 
+@st.cache_resource
+def get_app():
+    """アプリをプロセス内で共有（再実行のたびに初期化しない）"""
+    return EnglishLearningApp()
+
+@st.cache_resource
+def get_chat_context():
+    """チャットのコンテキスト管理をプロセス内で共有"""
+    return ChatContextManager(get_app())
+
+# 1回に読み込むチャット履歴の件数
+CHAT_PAGE_SIZE = 50
+
+def load_chat_window(app, user_id):
+    """セッションに保持した履歴に新着メッセージだけを追加して返す"""
+    if st.session_state.get('chat_window_user_id') != user_id:
+        rows = app.get_chat_history(user_id, limit=CHAT_PAGE_SIZE)
+        st.session_state.chat_window_user_id = user_id
+        st.session_state.chat_window = rows
+        st.session_state.chat_has_older = len(rows) == CHAT_PAGE_SIZE
+    else:
+        window = st.session_state.chat_window
+        last_id = window[-1][0] if window else 0
+        window.extend(app.get_chat_history(user_id, after_id=last_id))
+    return st.session_state.chat_window
+
+def load_older_messages(app, user_id):
+    """表示中の最も古いメッセージより前の履歴を1ページ分読み込む"""
+    window = st.session_state.chat_window
+    if not window:
+        return
+    older = app.get_chat_history(user_id, before_id=window[0][0], limit=CHAT_PAGE_SIZE)
+    st.session_state.chat_window = older + window
+    st.session_state.chat_has_older = len(older) == CHAT_PAGE_SIZE
+
+@traced('page', app='english_learning')
 def main():
     st.set_page_config(
         page_title="English Learning Assistant",
@@ -154,7 +169,7 @@ def main():
     st.title("英語学習アシスタント")
     st.markdown("英語学習を始めよう！")
     
-    app = EnglishLearningApp()
+    app = get_app()
     
     # サイドバーでユーザー選択
     st.sidebar.title("ユーザー管理")
@@ -204,13 +219,18 @@ def main():
         with tab1:
             st.subheader("💬 AIチャット")
             
-            # チャット履歴の表示
-            chat_history = app.get_chat_history(st.session_state.user_id)
+            # チャット履歴の表示（前回以降の新着のみ取得）
+            chat_history = load_chat_window(app, st.session_state.user_id)
+            
+            if st.session_state.chat_has_older:
+                if st.button("⬆️ 以前のメッセージを読み込む"):
+                    load_older_messages(app, st.session_state.user_id)
+                    st.rerun()
             
             # チャット表示エリア
             chat_container = st.container()
             with chat_container:
-                for role, content, timestamp in chat_history:
+                for _, role, content, timestamp in chat_history:
                     if role == "user":
                         st.markdown(f"**あなた:** {content}")
                     else:
@@ -220,29 +240,30 @@ def main():
             user_input = st.text_input("メッセージを入力してください：", key="chat_input")
             
             if st.button("送信") and user_input:
-                # ユーザーメッセージを保存
-                app.save_chat_message(st.session_state.user_id, "user", user_input)
-                
-                # LLMへのメッセージを準備（履歴込み）
-                messages = []
-                for role, content, _ in chat_history:
-                    messages.append({"role": role, "content": content})
-                messages.append({"role": "user", "content": user_input})
+                # チャットの応答は学習計画などの生成より先に処理する
+                with app.llm.prioritized(PRIORITY_CHAT), queue_status():
+                    # LLMへのメッセージを準備（要約＋直近の履歴、トークン上限内）
+                    messages = get_chat_context().build_messages(st.session_state.user_id, user_input)
+                    
+                    # AI応答をストリーミング表示しながら取得
+                    st.markdown(f"**あなた:** {user_input}")
+                    ai_response = stream_to_placeholder(st.empty(), app.stream_llm_response(messages))
                 
-                # AI応答を取得
-                ai_response = app.get_llm_response(messages)
-                
-                # AI応答を保存
-                app.save_chat_message(st.session_state.user_id, "assistant", ai_response)
-                
-                # ページをリロード
-                st.rerun()
+                # 応答を得られなかったやり取りは履歴に残さない（入力欄の内容はそのまま再送できる）
+                if ai_response and not isinstance(ai_response, FallbackText):
+                    app.save_chat_message(st.session_state.user_id, "user", user_input)
+                    app.save_chat_message(st.session_state.user_id, "assistant", ai_response)
+                    # 古い会話の要約は次の応答を待たせないよう別スレッドで更新する
+                    get_chat_context().fold_pending_in_background(st.session_state.user_id)
+                    
+                    # ページをリロード
+                    st.rerun()
         
         with tab2:
             st.subheader("📋 あなた専用の学習計画")
             
             if st.button("学習計画を生成"):
-                with st.spinner("学習計画を作成中..."):
+                with st.spinner("学習計画を作成中..."), queue_status():
                     learning_plan = app.generate_learning_plan(st.session_state.user_info)
                     st.markdown(learning_plan)
         
@@ -256,6 +277,10 @@ def main():
                 "達成度（%）": [70, 85, 60, 90, 75]
             }
             
+            # pandas・plotly は読み込みに時間がかかるため、グラフを描くときに読み込む
+            import pandas as pd
+            import plotly.express as px
+            
             df = pd.DataFrame(progress_data)
             
             col1, col2 = st.columns(2)
@@ -0,0 +1,78 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from metrics import annotate
+from llm_admission import current_feedback, waiting_feedback
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """プロセス共通のスレッドプールを取得
+
+    同時実行数の制限と順番待ちは受付制御（優先度付きの待ち行列）に任せるため、
+    処理枠と待ち行列の上限の合計までスレッドを使えるようにする（スレッドは必要になった分だけ作られる）。
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from llm_gateway import get_gateway
+
+                admission = get_gateway().admission
+                _executor = ThreadPoolExecutor(
+                    max_workers=admission.max_in_flight + admission.max_queue,
+                    thread_name_prefix='llm-fanout'
+                )
+    return _executor
+
+
+def _with_script_context(func):
+    """Streamlitのスクリプトコンテキストをワーカースレッドへ引き継ぐ"""
+    try:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    except ImportError:
+        return func
+
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        return func
+
+    def wrapper():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return func()
+    return wrapper
+
+
+def _with_queue_time(func):
+    """投入から実行開始までの待ち時間をLLMスパンの queue_ms として記録"""
+    submitted = time.perf_counter()
+
+    def wrapper():
+        with annotate('llm', queue_ms=(time.perf_counter() - submitted) * 1000):
+            return func()
+    return wrapper
+
+
+def _with_waiting_feedback(func):
+    """投入元のスレッドの順番待ち表示をワーカースレッドへ引き継ぐ"""
+    feedback = current_feedback()
+    if feedback is None:
+        return func
+
+    def wrapper():
+        with waiting_feedback(feedback):
+            return func()
+    return wrapper
+
+
+def run_concurrently(tasks):
+    """独立したタスクを並列実行し、完了した順に (名前, 結果) を返す"""
+    executor = get_executor()
+    futures = {
+        executor.submit(_with_script_context(_with_waiting_feedback(_with_queue_time(func)))): name
+        for name, func in tasks.items()
+    }
+    for future in as_completed(futures):
+        yield futures[future], future.result()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import math
+from contextlib import contextmanager
+import streamlit as st
+from llm_gateway import get_gateway
+from llm_admission import FallbackText, waiting_feedback
+from fanout import run_concurrently
+
+MEMO_STATE_KEY = '_generation_memo'
+REFRESH_STATE_KEY = '_generation_refresh'
+
+
+def payload_digest(payload):
+    """入力内容からキーを作成"""
+    serialized = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def memoized_generation(page, name, payload, generate):
+    """セッション内で生成結果を保持し、再実行時は再利用する"""
+    memo = st.session_state.setdefault(MEMO_STATE_KEY, {})
+    refresh_pages = st.session_state.setdefault(REFRESH_STATE_KEY, set())
+    key = (page, name, payload_digest(payload))
+
+    if key in memo:
+        return memo[key]
+
+    with queue_status():
+        if page in refresh_pages:
+            # 再生成が要求されたページは応答キャッシュを使わずに生成し直す
+            with get_gateway().bypass_cache():
+                result = generate()
+        else:
+            result = generate()
+
+    # 失敗（None）や混雑時の定型文は保持せず、次の再実行で再度生成する
+    if result is not None and not isinstance(result, FallbackText):
+        memo[key] = result
+    return result
+
+
+def memoized_generations(page, payload, generators):
+    """複数の生成を並列に実行し、完了した順に (名前, 結果) を返す（保持済みのものは即座に返す）"""
+    memo = st.session_state.setdefault(MEMO_STATE_KEY, {})
+    refresh = page in st.session_state.setdefault(REFRESH_STATE_KEY, set())
+    digest = payload_digest(payload)
+
+    pending = {}
+    for name, generate in generators.items():
+        key = (page, name, digest)
+        if key in memo:
+            yield name, memo[key]
+        else:
+            pending[name] = _bypassing_cache(generate) if refresh else generate
+
+    if not pending:
+        return
+    with queue_status():
+        for name, result in run_concurrently(pending):
+            if result is not None and not isinstance(result, FallbackText):
+                memo[(page, name, digest)] = result
+            yield name, result
+
+
+def stream_to_placeholder(placeholder, chunks):
+    """ストリーミング応答を逐次表示し、全文を返す（途中で失敗した場合は定型文を返す）"""
+    text = ''
+    for chunk in chunks:
+        if isinstance(chunk, FallbackText):
+            # 表示済みの途中までの文章は消さずに残す（保持・保存はしない）
+            with placeholder.container():
+                if text:
+                    st.markdown(text)
+                st.warning(chunk)
+            return chunk
+        text += chunk
+        placeholder.markdown(text + "▌")
+    return text or None
+
+
+@contextmanager
+def queue_status():
+    """LLMの呼び出しが順番待ちの間、順番と待ち時間の目安を表示"""
+    placeholder = st.empty()
+
+    def show(position, wait):
+        message = f"⏳ ただいま混雑しています。{position}番目に順番待ち中です"
+        if wait is not None:
+            message += f"（目安: 約{math.ceil(wait)}秒）"
+        placeholder.info(message)
+
+    try:
+        with waiting_feedback(show):
+            yield
+    finally:
+        placeholder.empty()
+
+
+def _bypassing_cache(generate):
+    """ワーカースレッド内で応答キャッシュを使わずに生成する"""
+    def wrapper():
+        with get_gateway().bypass_cache():
+            return generate()
+    return wrapper
+
+
+def finish_page_generation(page):
+    """ページの生成が終わったら再生成フラグを解除"""
+    st.session_state.setdefault(REFRESH_STATE_KEY, set()).discard(page)
+
+
+def clear_page_generation(page):
+    """ページの生成結果を破棄"""
+    memo = st.session_state.setdefault(MEMO_STATE_KEY, {})
+    for key in [key for key in memo if key[0] == page]:
+        del memo[key]
+
+
+def regenerate_button(page, label="🔄 メッセージを再生成"):
+    """生成結果を作り直すボタン"""
+    if st.button(label, key=f"regenerate_{page}"):
+        clear_page_generation(page)
+        st.session_state.setdefault(REFRESH_STATE_KEY, set()).add(page)
+        st.rerun()
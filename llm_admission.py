@@ -0,0 +1,199 @@
+"""LLM呼び出しの受付制御（プロセス共通）
+
+同時に処理する呼び出しを max_in_flight 件に抑え、超えた分は優先度順（チャット → 画面表示用の生成 → 一括生成）の
+待ち行列に入れる。待ち時間が優先度ごとの期限を超える見込みの呼び出しは、待たせずに Overloaded を送出する
+（呼び出し元は FallbackText の定型文を表示する）。
+
+設定は llm_router の設定ファイルの "admission" に書く（省略時は下記の既定値、max_in_flight は全バックエンドの上限の合計）。
+    "admission": {"max_in_flight": 8, "max_queue": 64, "deadlines": {"chat": 20, "interactive": 60, "bulk": null}}
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from metrics import span, increment
+
+PRIORITY_CHAT = 'chat'
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BULK = 'bulk'
+
+# 値が小さいほど先に処理する
+PRIORITY_ORDER = {PRIORITY_CHAT: 0, PRIORITY_INTERACTIVE: 1, PRIORITY_BULK: 2}
+
+# 待ち時間の期限（秒、None は期限なし）
+DEFAULT_DEADLINES = {PRIORITY_CHAT: 20.0, PRIORITY_INTERACTIVE: 60.0, PRIORITY_BULK: None}
+
+BUSY_MESSAGE = "ただいまアクセスが集中しているため、あなた専用の内容を作成できませんでした。少し時間をおいてから再生成してください。"
+
+
+class Overloaded(RuntimeError):
+    """混雑のため呼び出しを受け付けなかった"""
+
+
+class FallbackText(str):
+    """混雑時に生成の代わりに返す定型文（キャッシュ・保持・保存の対象にしない）"""
+
+
+_local = threading.local()
+
+
+@contextmanager
+def waiting_feedback(callback):
+    """このスレッドの呼び出しが待ち行列にいる間、callback(順番, 見込みの待ち秒数) を定期的に呼ぶ"""
+    previous = getattr(_local, 'feedback', None)
+    _local.feedback = callback
+    try:
+        yield
+    finally:
+        _local.feedback = previous
+
+
+def current_feedback():
+    """このスレッドに設定された待ち状況の通知先"""
+    return getattr(_local, 'feedback', None)
+
+
+class _Ticket:
+    __slots__ = ('granted', 'cancelled')
+
+    def __init__(self):
+        self.granted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    """同時実行数の上限と優先度付きの待ち行列"""
+
+    def __init__(self, max_in_flight=4, max_queue=64, deadlines=None, poll_interval=0.5):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.deadlines = dict(DEFAULT_DEADLINES, **(deadlines or {}))
+        self.poll_interval = poll_interval
+        self.in_flight = 0
+        self._queue = []
+        self._waiting = 0
+        self._sequence = itertools.count()
+        # 1件あたりの処理時間の指数移動平均（待ち時間の見込みに使う）
+        self._service_time = None
+        # _abandon から _release を呼ぶため再入可能なロックにする
+        self._condition = threading.Condition(threading.RLock())
+
+    @contextmanager
+    def admit(self, priority=PRIORITY_INTERACTIVE):
+        """処理枠を1つ確保して処理中の間だけ保持（期限内に確保できなければ Overloaded）"""
+        with span('llm_admission', priority=priority) as s:
+            waited = self._acquire(priority)
+            s.set(wait_ms=waited * 1000)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def estimate_wait(self, position):
+        """順番が position 番目のときの見込みの待ち秒数（実績がなければ None）"""
+        if self._service_time is None:
+            return None
+        return math.ceil(position / self.max_in_flight) * self._service_time
+
+    def _acquire(self, priority):
+        rank = PRIORITY_ORDER[priority]
+        deadline = self.deadlines.get(priority)
+        started = time.monotonic()
+
+        with self._condition:
+            if self.in_flight < self.max_in_flight and not self._waiting:
+                self.in_flight += 1
+                return 0.0
+            if self._waiting >= self.max_queue:
+                self._shed(priority, 'queue_full')
+            ahead = sum(1 for entry in self._queue if entry[0] <= rank and not entry[2].cancelled)
+            estimated = self.estimate_wait(ahead + 1)
+            if deadline is not None and estimated is not None and estimated > deadline:
+                self._shed(priority, 'predicted')
+            ticket = _Ticket()
+            heapq.heappush(self._queue, (rank, next(self._sequence), ticket))
+            self._waiting += 1
+
+        feedback = current_feedback()
+        try:
+            while True:
+                with self._condition:
+                    if ticket.granted:
+                        return time.monotonic() - started
+                    remaining = None if deadline is None else deadline - (time.monotonic() - started)
+                    if remaining is not None and remaining <= 0:
+                        self._abandon(ticket)
+                        self._shed(priority, 'deadline')
+                    position = self._position(ticket)
+
+                if feedback is not None:
+                    feedback(position, self.estimate_wait(position))
+
+                with self._condition:
+                    if not ticket.granted:
+                        timeout = self.poll_interval if remaining is None else min(self.poll_interval, remaining)
+                        self._condition.wait(timeout)
+        except BaseException:
+            # Streamlitの再実行・停止（StopException など）で待ちが中断されても枠を残さない
+            self._abandon(ticket)
+            raise
+
+    def _abandon(self, ticket):
+        """待つのをやめた呼び出しを待ち行列から外す（既に枠が割り当てられていれば返す）"""
+        with self._condition:
+            if ticket.granted:
+                ticket.granted = False
+                self._release()
+            elif not ticket.cancelled:
+                ticket.cancelled = True
+                self._queue = [entry for entry in self._queue if entry[2] is not ticket]
+                heapq.heapify(self._queue)
+                self._waiting -= 1
+
+    def _position(self, ticket):
+        """待ち行列での順番（1始まり）"""
+        key = next(entry[:2] for entry in self._queue if entry[2] is ticket)
+        return 1 + sum(1 for entry in self._queue if entry[:2] < key and not entry[2].cancelled)
+
+    def _shed(self, priority, reason):
+        increment('llm_admission_shed', priority=priority, reason=reason)
+        raise Overloaded(f"混雑のため受け付けできませんでした（{reason}）")
+
+    def _release(self, service_time=None):
+        """枠を返して待ち行列の先頭に割り当てる（service_time が None なら処理時間の実績に含めない）"""
+        with self._condition:
+            self.in_flight -= 1
+            if service_time is not None:
+                if self._service_time is None:
+                    self._service_time = service_time
+                else:
+                    self._service_time = 0.8 * self._service_time + 0.2 * service_time
+
+            while self._queue and self.in_flight < self.max_in_flight:
+                _, _, ticket = heapq.heappop(self._queue)
+                if ticket.cancelled:
+                    continue
+                ticket.granted = True
+                self._waiting -= 1
+                self.in_flight += 1
+            self._condition.notify_all()
+
+    def status(self):
+        """処理中・待ち行列の件数"""
+        with self._condition:
+            return {
+                'in_flight': self.in_flight,
+                'waiting': self._waiting,
+                'max_in_flight': self.max_in_flight,
+                'service_time': self._service_time,
+            }
+
+
+def from_config(config, capacity):
+    """設定から受付制御を作成（max_in_flight の既定値はバックエンドの同時実行数の合計）"""
+    options = dict(config or {})
+    options.setdefault('max_in_flight', capacity)
+    return AdmissionController(**options)
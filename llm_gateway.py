@@ -0,0 +1,345 @@
+import hashlib
+import json
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+from database import transaction, execute, fetch_one
+from metrics import span, increment
+from llm_router import Backend, BackendRouter, get_router, load_config, DEFAULT_MODEL
+from llm_admission import PRIORITY_INTERACTIVE, from_config as admission_from_config
+from llm_resilience import RetryPolicy, CircuitBreaker, DeadlineExceeded, DEFAULT_REQUEST_TIMEOUT
+
+
+def completion(*args, **kwargs):
+    """litellm.completion（litellm は読み込みに数秒かかるため、最初の呼び出し時に読み込む）"""
+    from litellm import completion as litellm_completion
+    return litellm_completion(*args, **kwargs)
+
+
+def token_counter(*args, **kwargs):
+    """litellm.token_counter（最初の呼び出し時に litellm を読み込む）"""
+    from litellm import token_counter as litellm_token_counter
+    return litellm_token_counter(*args, **kwargs)
+
+
+def normalize_text(text):
+    """キャッシュキー用にテキストを正規化（Unicode正規化・行ごとの空白除去）"""
+    text = unicodedata.normalize('NFKC', text or '')
+    lines = [line.strip() for line in text.splitlines()]
+    return '\n'.join(lines).strip()
+
+
+def normalize_messages(messages):
+    """メッセージ列を正規化"""
+    return [
+        {"role": message.get("role", "user"), "content": normalize_text(message.get("content"))}
+        for message in messages
+    ]
+
+
+class LLMCache:
+    """プロンプト→応答のディスクキャッシュ（SQLite、TTL・LRU上限付き）"""
+
+    def __init__(self, db_path='llm_cache.db', ttl_seconds=7 * 24 * 3600, max_entries=5000):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.init_database()
+
+    def init_database(self):
+        """キャッシュテーブルの初期化"""
+        with transaction(self.db_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_accessed REAL NOT NULL,
+                    hit_count INTEGER DEFAULT 0
+                )
+            ''')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_llm_cache_last_accessed ON llm_cache (last_accessed)'
+            )
+
+    @staticmethod
+    def make_key(model, messages, params=None):
+        """モデル・正規化済みメッセージ・サンプリングパラメータからキーを作成"""
+        payload = json.dumps({
+            "model": model,
+            "messages": normalize_messages(messages),
+            "params": params or {},
+        }, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """キャッシュから応答を取得（期限切れは削除）"""
+        now = time.time()
+        with transaction(self.db_path) as conn:
+            row = conn.execute(
+                'SELECT response, created_at FROM llm_cache WHERE cache_key = ?', (key,)
+            ).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                conn.execute('DELETE FROM llm_cache WHERE cache_key = ?', (key,))
+                row = None
+            if row is not None:
+                conn.execute('''
+                    UPDATE llm_cache SET last_accessed = ?, hit_count = hit_count + 1
+                    WHERE cache_key = ?
+                ''', (now, key))
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def set(self, key, model, response):
+        """応答をキャッシュに保存し、上限を超えたら古いものから削除"""
+        now = time.time()
+        with transaction(self.db_path) as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO llm_cache (cache_key, model, response, created_at, last_accessed, hit_count)
+                VALUES (?, ?, ?, ?, ?, 0)
+            ''', (key, model, response, now, now))
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        """期限切れとLRU上限超過分を削除"""
+        if self.ttl_seconds is not None:
+            conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (now - self.ttl_seconds,))
+        if self.max_entries is not None:
+            conn.execute('''
+                DELETE FROM llm_cache WHERE cache_key IN (
+                    SELECT cache_key FROM llm_cache
+                    ORDER BY last_accessed DESC
+                    LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,))
+
+    def clear(self):
+        """キャッシュを全削除"""
+        execute(self.db_path, 'DELETE FROM llm_cache')
+
+    def stats(self):
+        """ヒット・ミスの統計を取得"""
+        entries = fetch_one(self.db_path, 'SELECT COUNT(*) FROM llm_cache')[0]
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'entries': entries,
+        }
+
+
+class LLMGateway:
+    """全アプリ共通のLLM呼び出し窓口"""
+
+    def __init__(self, model=None, api_base=None, cache=None, router=None, admission=None, config=None):
+        # api_base を指定した場合は設定ファイルを使わずその1台だけに送る（ベンチマーク・検証用）
+        if config is None:
+            config = {} if api_base else load_config()
+        if router is None:
+            router = BackendRouter([Backend(api_base)], model=model or DEFAULT_MODEL) if api_base else get_router()
+        self.router = router
+        self.admission = admission or admission_from_config(config.get('admission'), router.capacity())
+        self.request_timeout = config.get('request_timeout', DEFAULT_REQUEST_TIMEOUT)
+        self.retry = RetryPolicy(**config.get('retry', {}))
+        self.breaker = CircuitBreaker(**config.get('circuit_breaker', {}))
+        self.model = model or router.model
+        self.cache = cache if cache is not None else LLMCache()
+        self._local = threading.local()
+
+    @contextmanager
+    def bypass_cache(self):
+        """このスレッドの呼び出しでキャッシュ参照をスキップ（結果は保存する）"""
+        previous = getattr(self._local, 'bypass', False)
+        self._local.bypass = True
+        try:
+            yield
+        finally:
+            self._local.bypass = previous
+
+    @contextmanager
+    def prioritized(self, priority):
+        """このスレッドの呼び出しの優先度を指定（chat / interactive / bulk）"""
+        previous = getattr(self._local, 'priority', None)
+        self._local.priority = priority
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def current_priority(self):
+        """このスレッドの呼び出しの優先度"""
+        return getattr(self._local, 'priority', None) or PRIORITY_INTERACTIVE
+
+    def is_bypassing_cache(self):
+        """このスレッドでキャッシュ参照をスキップ中か"""
+        return getattr(self._local, 'bypass', False)
+
+    def _lookup_cache(self, key):
+        """キャッシュを参照し、ヒット・ミスを計測に記録"""
+        if self.is_bypassing_cache():
+            increment('llm_cache_lookups', result='bypass')
+            return None
+        cached = self.cache.get(key)
+        increment('llm_cache_lookups', result='miss' if cached is None else 'hit')
+        return cached
+
+    def complete(self, messages, model=None, api_base=None, use_cache=True, timeout=None, **params):
+        """LLMからの応答テキストを取得（キャッシュ優先、timeout 秒以内にリトライを含めて終わらなければ例外）"""
+        model = model or self.model
+
+        key = None
+        if use_cache and self.cache is not None:
+            key = self.cache.make_key(model, messages, params)
+            cached = self._lookup_cache(key)
+            if cached is not None:
+                return cached
+
+        with self.breaker.guard(), self.admission.admit(self.current_priority()):
+            content = self.retry.call(
+                lambda remaining: self._complete_once(messages, model, api_base, remaining, params),
+                timeout or self.request_timeout
+            )
+
+        if key is not None and content:
+            self.cache.set(key, model, content)
+        return content
+
+    def _complete_once(self, messages, model, api_base, timeout, params):
+        """1回分の呼び出し（バックエンドの空き待ちを含めて timeout 秒以内）"""
+        deadline = time.monotonic() + timeout
+        with span('llm', mode='complete', model=model) as s, self._backend(api_base, timeout) as backend:
+            s.set(backend=backend)
+            response = completion(
+                model=model,
+                messages=messages,
+                api_base=backend,
+                timeout=deadline - time.monotonic(),
+                **params
+            )
+            usage = getattr(response, 'usage', None)
+            if usage is not None:
+                s.set(
+                    prompt_tokens=getattr(usage, 'prompt_tokens', None) or 0,
+                    completion_tokens=getattr(usage, 'completion_tokens', None) or 0
+                )
+            return response.choices[0].message.content
+
+    def stream(self, messages, model=None, api_base=None, use_cache=True, timeout=None, **params):
+        """LLMの応答をトークンごとに返すジェネレーター（完了後にキャッシュへ保存、最初のトークンまでの失敗はリトライ）
+
+        timeout 秒は最初のトークンまでの期限とチャンク間の待ち時間の上限で、応答全体の長さは制限しない
+        （長い応答を生成中の正常なバックエンドを障害として数えないため）。
+        """
+        model = model or self.model
+
+        key = None
+        if use_cache and self.cache is not None:
+            key = self.cache.make_key(model, messages, params)
+            cached = self._lookup_cache(key)
+            if cached is not None:
+                yield cached
+                return
+
+        chunks = []
+        with self.breaker.guard(), self.admission.admit(self.current_priority()):
+            deadline = time.monotonic() + (timeout or self.request_timeout)
+            self.retry.budget.deposit()
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    yield from self._stream_once(messages, model, api_base, deadline, params, chunks)
+                    break
+                except Exception as e:
+                    # 一部でも返した後は途中から作り直せないためリトライしない
+                    delay = self.retry.backoff(attempt)
+                    if chunks or not self.retry.should_retry(e, attempt, deadline - time.monotonic(), delay):
+                        raise
+                    time.sleep(delay)
+
+        content = ''.join(chunks)
+        if key is not None and content:
+            self.cache.set(key, model, content)
+
+    def _stream_once(self, messages, model, api_base, deadline, params, chunks):
+        """1回分のストリーミング呼び出し（受け取ったトークンは chunks に追加、最初のトークンが deadline までに来なければ DeadlineExceeded）"""
+        # 最後のチャンクを受け取るまでバックエンドを処理中として数える
+        with span('llm', mode='stream', model=model) as s, \
+                self._backend(api_base, deadline - time.monotonic()) as backend:
+            s.set(backend=backend)
+            response = completion(
+                model=model,
+                messages=messages,
+                api_base=backend,
+                stream=True,
+                timeout=deadline - time.monotonic(),
+                **params
+            )
+            usage = None
+            for chunk in response:
+                # 最初のトークンまでは応答全体の期限で打ち切る（以降のチャンク間の待ちは completion の timeout で制限される）
+                if not chunks and time.monotonic() > deadline:
+                    close = getattr(response, 'close', None)
+                    if close is not None:
+                        close()
+                    raise DeadlineExceeded("LLMの応答が期限内に終わりませんでした")
+                usage = getattr(chunk, 'usage', None) or usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not chunks:
+                        s.set(ttft_ms=(time.perf_counter() - s.started) * 1000)
+                    chunks.append(delta)
+                    yield delta
+            s.set(**self._stream_token_counts(model, messages, chunks, usage))
+
+    @contextmanager
+    def _backend(self, api_base=None, timeout=None):
+        """送信先のURL（指定がなければルーターで振り分け、空きを待つのは timeout 秒まで）"""
+        if api_base:
+            yield api_base
+            return
+        with self.router.use(timeout) as backend:
+            yield backend.api_base
+
+    @staticmethod
+    def _stream_token_counts(model, messages, chunks, usage):
+        """ストリーミング応答のトークン数（usageがなければトークナイザーで数える）"""
+        if usage is not None and getattr(usage, 'completion_tokens', None):
+            return {
+                'prompt_tokens': getattr(usage, 'prompt_tokens', None) or 0,
+                'completion_tokens': usage.completion_tokens,
+            }
+        try:
+            return {
+                'prompt_tokens': token_counter(model=model, messages=messages),
+                'completion_tokens': token_counter(model=model, text=''.join(chunks)),
+            }
+        except Exception:
+            return {'completion_tokens': len(chunks)}
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """プロセス共通のゲートウェイを取得"""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
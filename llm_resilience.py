@@ -0,0 +1,172 @@
+"""LLM呼び出しの障害対策（呼び出しごとの期限・ジッター付きリトライ・サーキットブレーカー）
+
+設定は llm_router の設定ファイルに書く（省略時は下記の既定値）。
+    "request_timeout": 60,
+    "retry": {"max_attempts": 3, "base_delay": 0.5, "max_delay": 4.0, "budget_ratio": 0.2, "budget_max": 10},
+    "circuit_breaker": {"failure_threshold": 5, "reset_timeout": 30}
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from metrics import increment
+from llm_admission import Overloaded, FallbackText, BUSY_MESSAGE
+
+# 1回の呼び出し（リトライを含む）の期限（秒）
+DEFAULT_REQUEST_TIMEOUT = 60.0
+
+UNAVAILABLE_MESSAGE = "現在AIサーバーに接続できないため、あなた専用の内容を作成できませんでした。少し時間をおいてから再生成してください。"
+
+
+class CircuitOpen(RuntimeError):
+    """障害が続いているため呼び出しを行わなかった"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """呼び出しの期限までに応答が始まらなかった（サーバー側のタイムアウトとして扱う）"""
+    status_code = 408
+
+
+def is_backend_failure(error):
+    """サーバー側の障害・タイムアウトによる失敗か（リクエスト内容の誤りによる4xxは数えない）"""
+    if isinstance(error, (Overloaded, CircuitOpen)):
+        return False
+    status = getattr(error, 'status_code', None)
+    if isinstance(status, int) and 400 <= status < 500:
+        # タイムアウトと過負荷はサーバー側の問題として扱う
+        return status in (408, 429)
+    return True
+
+
+def fallback_text(error):
+    """失敗した呼び出しの代わりに表示する定型文"""
+    increment('llm_fallbacks', reason=type(error).__name__)
+    return FallbackText(BUSY_MESSAGE if isinstance(error, Overloaded) else UNAVAILABLE_MESSAGE)
+
+
+class RetryBudget:
+    """リトライの総量を抑えるトークンバケット（呼び出しごとに ratio 貯まり、リトライ1回で1消費）"""
+
+    def __init__(self, ratio=0.2, max_tokens=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """リトライしてよければ True"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """期限内でのジッター付き指数バックオフ"""
+
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=4.0, budget_ratio=0.2, budget_max=10.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = RetryBudget(budget_ratio, budget_max)
+
+    def backoff(self, attempt):
+        """attempt 回目の失敗後の待ち秒数（0〜上限の一様乱数、full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def should_retry(self, error, attempt, remaining, delay):
+        """もう一度試すか（期限内に収まり、リトライの予算が残っている場合のみ）"""
+        if not is_backend_failure(error) or attempt >= self.max_attempts or remaining <= delay:
+            return False
+        if not self.budget.withdraw():
+            increment('llm_retry_budget_exhausted')
+            return False
+        increment('llm_retries', reason=type(error).__name__)
+        return True
+
+    def call(self, attempt_func, timeout):
+        """attempt_func(残り秒数) を期限内でリトライしながら実行"""
+        self.budget.deposit()
+        deadline = time.monotonic() + timeout
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return attempt_func(deadline - time.monotonic())
+            except Exception as e:
+                delay = self.backoff(attempt)
+                if not self.should_retry(e, attempt, deadline - time.monotonic(), delay):
+                    raise
+                time.sleep(delay)
+
+
+class CircuitBreaker:
+    """失敗が続いたら一定時間は呼び出さずに失敗させ、その後1件だけ試して復旧を確認する"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def guard(self):
+        """呼び出しを許可できなければ CircuitOpen、許可したら結果を記録"""
+        trial = self._before_call()
+        outcome = None
+        try:
+            yield
+            outcome = True
+        except Exception as e:
+            if is_backend_failure(e):
+                outcome = False
+            raise
+        finally:
+            self._after_call(outcome, trial)
+
+    def _before_call(self):
+        """呼び出しを許可（復旧確認の1件なら True を返す）"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    increment('llm_circuit_rejected')
+                    raise CircuitOpen("LLMサーバーの障害が続いているため呼び出しを停止中です")
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._trial_running:
+                    increment('llm_circuit_rejected')
+                    raise CircuitOpen("LLMサーバーの復旧を確認中です")
+                self._trial_running = True
+                return True
+            return False
+
+    def _after_call(self, outcome, trial):
+        """outcome: True=成功、False=サーバー側の失敗、None=判定しない（混雑・中断・4xx）"""
+        with self._lock:
+            if trial:
+                self._trial_running = False
+            if outcome is True:
+                self.failures = 0
+                self._set_state(self.CLOSED)
+            elif outcome is False:
+                self.failures += 1
+                if trial or self.failures >= self.failure_threshold:
+                    self._opened_at = time.monotonic()
+                    self._set_state(self.OPEN)
+
+    def _set_state(self, state):
+        if state != self.state:
+            increment('llm_circuit_transitions', state=state)
+            self.state = state
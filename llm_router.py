@@ -0,0 +1,243 @@
+"""複数のOllamaバックエンドへのリクエストの振り分け
+
+設定は次の優先順で読み込む（どれもなければ localhost の1台構成）。
+    1. 環境変数 LLM_CONFIG で指定したJSONファイル
+    2. カレントディレクトリの llm_backends.json
+    3. 環境変数 LLM_BACKENDS（カンマ区切りのURL）と LLM_MODEL
+
+設定ファイルの例:
+    {
+        "model": "ollama/hf.co/elyza/Llama-3-ELYZA-JP-8B-GGUF",
+        "backends": [
+            {"api_base": "http://gpu-node-1:11434", "max_concurrency": 4},
+            {"api_base": "http://cpu-node-1:11434", "max_concurrency": 2},
+            "http://cpu-node-2:11434"
+        ],
+        "health_check_interval": 10,
+        "failure_threshold": 3,
+        "cooldown": 30,
+        "acquire_timeout": 120
+    }
+
+処理中のリクエストが（同時実行数の上限に対して）最も少ないバックエンドを選ぶ。
+呼び出しの失敗が続いたバックエンドは cooldown 秒間外し（パッシブ）、
+一定間隔で GET /api/tags を送って復旧・停止を検知する（アクティブ）。
+"""
+import json
+import os
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from metrics import increment
+from llm_resilience import is_backend_failure
+
+DEFAULT_MODEL = "ollama/hf.co/elyza/Llama-3-ELYZA-JP-8B-GGUF"
+DEFAULT_API_BASE = "http://localhost:11434"
+DEFAULT_CONFIG_PATH = 'llm_backends.json'
+# Ollama の OLLAMA_NUM_PARALLEL の既定値に合わせる
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+class NoBackendAvailable(RuntimeError):
+    """利用できるバックエンドがない"""
+
+
+class Backend:
+    """1台のOllamaサーバーの状態"""
+
+    def __init__(self, api_base, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        self.api_base = api_base.rstrip('/')
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.down_until = 0.0
+        self.requests = 0
+
+    def available(self, now):
+        """新しいリクエストを送れるか（停止中でも cooldown が過ぎていれば試す）"""
+        if self.outstanding >= self.max_concurrency:
+            return False
+        return self.healthy or now >= self.down_until
+
+    def load(self):
+        """上限に対する処理中リクエストの割合"""
+        return self.outstanding / self.max_concurrency
+
+
+class BackendRouter:
+    """バックエンドのプール（最小処理中リクエスト数での振り分け・ヘルスチェック・同時実行数の上限）"""
+
+    def __init__(self, backends, model=DEFAULT_MODEL, failure_threshold=3, cooldown=30.0,
+                 health_check_interval=10.0, acquire_timeout=120.0, health_timeout=2.0):
+        if not backends:
+            raise ValueError("バックエンドが指定されていません")
+        self.backends = list(backends)
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.health_timeout = health_timeout
+        self._condition = threading.Condition()
+        self._health_thread = None
+
+    def acquire(self, timeout=None):
+        """振り分け先を選んで処理中として数える（全台が上限に達していれば空くまで待つ）"""
+        timeout = self.acquire_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                candidates = [backend for backend in self.backends if backend.available(now)]
+                if candidates:
+                    backend = min(candidates, key=lambda b: (not b.healthy, b.load(), b.requests))
+                    backend.outstanding += 1
+                    backend.requests += 1
+                    return backend
+
+                if not any(backend.outstanding for backend in self.backends):
+                    # 全台が停止中で、空きを待っても状況は変わらない
+                    increment('llm_router_rejected', reason='unhealthy')
+                    raise NoBackendAvailable("利用できるLLMサーバーがありません")
+                remaining = deadline - now
+                if remaining <= 0:
+                    increment('llm_router_rejected', reason='timeout')
+                    raise NoBackendAvailable("LLMサーバーの空きを待つ間にタイムアウトしました")
+                self._condition.wait(min(remaining, 1.0))
+
+    def release(self, backend, failed=False):
+        """処理中の数を戻し、結果をパッシブなヘルスチェックに反映"""
+        with self._condition:
+            backend.outstanding -= 1
+            if failed:
+                backend.failures += 1
+                increment('llm_backend_failures', backend=backend.api_base)
+                if backend.failures >= self.failure_threshold:
+                    self._mark_down(backend)
+            else:
+                backend.failures = 0
+                self._mark_up(backend)
+            self._condition.notify_all()
+
+    @contextmanager
+    def use(self, timeout=None):
+        """バックエンドを1つ確保して処理中の間だけ保持（timeout 秒以内に空かなければ NoBackendAvailable）"""
+        backend = self.acquire(timeout)
+        failed = False
+        try:
+            yield backend
+        except Exception as e:
+            failed = is_backend_failure(e)
+            raise
+        finally:
+            self.release(backend, failed)
+
+    def _mark_down(self, backend):
+        if backend.healthy:
+            increment('llm_backend_state_changes', backend=backend.api_base, state='down')
+        backend.healthy = False
+        backend.down_until = time.monotonic() + self.cooldown
+
+    def _mark_up(self, backend):
+        if not backend.healthy:
+            increment('llm_backend_state_changes', backend=backend.api_base, state='up')
+        backend.healthy = True
+        backend.down_until = 0.0
+
+    def probe(self, backend):
+        """GET /api/tags に応答するか"""
+        try:
+            with urllib.request.urlopen(backend.api_base + '/api/tags', timeout=self.health_timeout) as response:
+                return response.status == 200
+        except Exception:
+            return False
+
+    def check_health(self):
+        """全台にアクティブなヘルスチェックを行う"""
+        for backend in self.backends:
+            ok = self.probe(backend)
+            with self._condition:
+                if ok:
+                    backend.failures = 0
+                    self._mark_up(backend)
+                else:
+                    self._mark_down(backend)
+                self._condition.notify_all()
+
+    def start_health_checks(self):
+        """バックグラウンドで定期的にヘルスチェックを行う"""
+        if self._health_thread is not None or not self.health_check_interval:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.health_check_interval)
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=run, name='llm-health-check', daemon=True)
+        self._health_thread.start()
+
+    def capacity(self):
+        """全バックエンドの同時実行数の上限の合計"""
+        return sum(backend.max_concurrency for backend in self.backends)
+
+    def status(self):
+        """各バックエンドの状態"""
+        with self._condition:
+            return [
+                {
+                    'api_base': backend.api_base,
+                    'healthy': backend.healthy,
+                    'outstanding': backend.outstanding,
+                    'max_concurrency': backend.max_concurrency,
+                    'requests': backend.requests,
+                }
+                for backend in self.backends
+            ]
+
+
+def load_config(path=None):
+    """ルーターの設定を読み込む"""
+    path = path or os.environ.get('LLM_CONFIG') or DEFAULT_CONFIG_PATH
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    backends = [url.strip() for url in os.environ.get('LLM_BACKENDS', '').split(',') if url.strip()]
+    return {
+        'model': os.environ.get('LLM_MODEL', DEFAULT_MODEL),
+        'backends': backends or [DEFAULT_API_BASE],
+    }
+
+
+def from_config(config):
+    """設定からルーターを作成"""
+    backends = []
+    for entry in config.get('backends') or [DEFAULT_API_BASE]:
+        if isinstance(entry, str):
+            entry = {'api_base': entry}
+        backends.append(Backend(entry['api_base'], entry.get('max_concurrency', DEFAULT_MAX_CONCURRENCY)))
+    options = {
+        key: config[key]
+        for key in ('failure_threshold', 'cooldown', 'health_check_interval', 'acquire_timeout', 'health_timeout')
+        if key in config
+    }
+    return BackendRouter(backends, model=config.get('model', DEFAULT_MODEL), **options)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """プロセス共通のルーターを取得（初回にヘルスチェックを開始）"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                router = from_config(load_config())
+                router.start_health_checks()
+                _router = router
+    return _router
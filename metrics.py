@@ -0,0 +1,283 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# レイテンシのヒストグラム境界（ミリ秒）
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class Span:
+    """1回の処理の計測結果"""
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.attributes = {}
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+
+    def set(self, **attributes):
+        """トークン数やTTFTなどの付加情報を記録"""
+        self.attributes.update(attributes)
+
+
+class Metrics:
+    """軽量なスパン計測とメトリクス集計（Prometheusテキスト形式・SQLiteに出力）"""
+
+    def __init__(self, db_path='metrics.db', flush_interval=5.0, flush_size=200, max_rows=100000):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._pending = []
+        self._table_ready = False
+        self._flusher = None
+        self._server = None
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name, **labels):
+        """処理時間を計測するスパン"""
+        span = Span(name, labels)
+        span.attributes.update(getattr(self._local, 'attributes', {}).get(name, {}))
+        try:
+            yield span
+        except Exception as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration_ms = (time.perf_counter() - span.started) * 1000
+            self.record(span)
+
+    @contextmanager
+    def annotate(self, name, **attributes):
+        """このスレッドで開始する name のスパンに共通の付加情報（キュー待ち時間など）を付ける"""
+        previous = getattr(self._local, 'attributes', {})
+        self._local.attributes = dict(previous, **{name: dict(previous.get(name, {}), **attributes)})
+        try:
+            yield
+        finally:
+            self._local.attributes = previous
+
+    def traced(self, name, **labels):
+        """関数の実行時間を計測するデコレーター"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, function=func.__name__, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record(self, span):
+        """スパンを集計に加え、SQLite書き込み待ちに積む"""
+        labels = dict(span.labels, status='error' if span.error else 'ok')
+        with self._lock:
+            self._observe(f"{span.name}_duration_ms", labels, span.duration_ms)
+            for key, value in span.attributes.items():
+                # *_ms はヒストグラム、整数（トークン数など）はカウンター、それ以外はSQLiteにのみ残す
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if key.endswith('_ms'):
+                    self._observe(f"{span.name}_{key}", span.labels, value)
+                elif isinstance(value, int):
+                    self._increment(f"{span.name}_{key}_total", span.labels, value)
+            self._pending.append((
+                time.time(), span.name, json.dumps(labels, ensure_ascii=False, sort_keys=True),
+                span.duration_ms, json.dumps(span.attributes, ensure_ascii=False, default=str)
+            ))
+            should_flush = len(self._pending) >= self.flush_size
+        self._ensure_flusher()
+        if should_flush:
+            try:
+                self.flush()
+            except Exception:
+                # 計測の失敗でアプリを止めない
+                pass
+
+    def increment(self, name, value=1, **labels):
+        """カウンターを加算"""
+        with self._lock:
+            self._increment(f"{name}_total", labels, value)
+
+    def _increment(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def _observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = {'buckets': [0] * len(LATENCY_BUCKETS_MS), 'count': 0, 'sum': 0.0}
+            self._histograms[key] = histogram
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if value <= bound:
+                histogram['buckets'][i] += 1
+        histogram['count'] += 1
+        histogram['sum'] += value
+
+    def export_prometheus(self):
+        """Prometheusテキスト形式で出力"""
+        def format_labels(items, extra=()):
+            pairs = [f'{k}="{_escape(v)}"' for k, v in list(items) + list(extra)]
+            return '{' + ','.join(pairs) + '}' if pairs else ''
+
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            for bound, count in zip(LATENCY_BUCKETS_MS, histogram['buckets']):
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']:.3f}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        """溜まったスパンをSQLiteにまとめて書き込み、古い行を削除"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows or self.db_path is None:
+            return
+
+        from database import get_pool
+
+        with get_pool(self.db_path).transaction() as conn:
+            if not self._table_ready:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS spans (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        recorded_at REAL NOT NULL,
+                        name TEXT NOT NULL,
+                        labels TEXT,
+                        duration_ms REAL,
+                        attributes TEXT
+                    )
+                ''')
+                self._table_ready = True
+            conn.executemany('''
+                INSERT INTO spans (recorded_at, name, labels, duration_ms, attributes)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            conn.execute(
+                'DELETE FROM spans WHERE id <= (SELECT MAX(id) FROM spans) - ?',
+                (self.max_rows,)
+            )
+
+    def _ensure_flusher(self):
+        """一定間隔でflushするバックグラウンドスレッドを起動"""
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+
+            def run():
+                while True:
+                    time.sleep(self.flush_interval)
+                    try:
+                        self.flush()
+                    except Exception:
+                        # 計測の失敗でアプリを止めない
+                        pass
+
+            self._flusher = threading.Thread(target=run, name='metrics-flusher', daemon=True)
+            self._flusher.start()
+
+    def start_http_server(self, port, host='127.0.0.1'):
+        """/metrics を返すHTTPサーバーをバックグラウンドで起動"""
+        if self._server is not None:
+            return self._server
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = metrics.export_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        return self._server
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """プロセス共通の計測器を取得（METRICS_PORT が設定されていれば /metrics を公開）"""
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                metrics = Metrics()
+                port = os.environ.get('METRICS_PORT')
+                if port:
+                    try:
+                        metrics.start_http_server(int(port))
+                    except OSError:
+                        # 複数プロセスで同じポートを使おうとした場合は公開しない
+                        pass
+                _metrics = metrics
+    return _metrics
+
+
+def span(name, **labels):
+    """共通の計測器でスパンを開始"""
+    return get_metrics().span(name, **labels)
+
+
+def annotate(name, **attributes):
+    """共通の計測器でスレッド内のスパンに付加情報を付ける"""
+    return get_metrics().annotate(name, **attributes)
+
+
+def increment(name, value=1, **labels):
+    """共通の計測器のカウンターを加算"""
+    get_metrics().increment(name, value, **labels)
+
+
+def traced(name, **labels):
+    """共通の計測器で関数を計測するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, function=func.__name__, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,367 @@
+import threading
+from database import get_pool
+
+# データベースごとのスキーマ変更履歴（version, 説明, SQL文のリスト）
+# 既存のバージョンは書き換えず、変更は必ず末尾に新しいバージョンとして追加する
+SCHEMAS = {
+    'english_learning': [
+        (1, "initial schema", [
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                age INTEGER,
+                occupation TEXT,
+                english_level TEXT,
+                goal TEXT,
+                interests TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS chat_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS learning_progress (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                activity TEXT,
+                progress_score INTEGER,
+                date DATE,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''',
+        ]),
+        (2, "indexes for per-user history lookups", [
+            'CREATE INDEX IF NOT EXISTS idx_chat_history_user_timestamp ON chat_history (user_id, timestamp)',
+            'CREATE INDEX IF NOT EXISTS idx_learning_progress_user_date ON learning_progress (user_id, date)',
+        ]),
+        (3, "index for keyset-paginated chat history", [
+            'CREATE INDEX IF NOT EXISTS idx_chat_history_user_id ON chat_history (user_id, id)',
+        ]),
+        (4, "rolling chat summaries", [
+            '''
+            CREATE TABLE IF NOT EXISTS chat_summaries (
+                user_id INTEGER PRIMARY KEY,
+                summary TEXT NOT NULL,
+                last_message_id INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            ''',
+        ]),
+    ],
+    'motivation': [
+        (1, "initial schema", [
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT,
+                age INTEGER,
+                occupation TEXT,
+                current_situation TEXT,
+                pain_points TEXT,
+                dreams TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS assessments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                missed_opportunities INTEGER,
+                potential_income INTEGER,
+                time_wasted INTEGER,
+                stress_level INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+        ]),
+    ],
+    'behavior_research': [
+        (1, "initial schema", [
+            # 参加者情報
+            '''
+            CREATE TABLE IF NOT EXISTS participants (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                age_group TEXT,
+                occupation_category TEXT,
+                english_motivation_level INTEGER,
+                initial_interest_score INTEGER,
+                experiment_group TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            # 行動変容段階（Transtheoretical Model）
+            '''
+            CREATE TABLE IF NOT EXISTS behavior_stages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                participant_id INTEGER,
+                stage TEXT, -- precontemplation, contemplation, preparation, action, maintenance
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                trigger_type TEXT,
+                confidence_level INTEGER
+            )
+            ''',
+            # インタラクション記録
+            '''
+            CREATE TABLE IF NOT EXISTS interactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                participant_id INTEGER,
+                interaction_type TEXT,
+                content TEXT,
+                response_time_ms INTEGER,
+                engagement_score INTEGER,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            # 実験条件
+            '''
+            CREATE TABLE IF NOT EXISTS experimental_conditions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                condition_name TEXT,
+                description TEXT,
+                psychological_principle TEXT
+            )
+            ''',
+        ]),
+        (2, "indexes for per-participant lookups", [
+            'CREATE INDEX IF NOT EXISTS idx_interactions_participant_timestamp ON interactions (participant_id, timestamp)',
+            'CREATE INDEX IF NOT EXISTS idx_behavior_stages_participant_timestamp ON behavior_stages (participant_id, timestamp)',
+        ]),
+        (3, "session id for buffered interaction events", [
+            'ALTER TABLE interactions ADD COLUMN session_id TEXT',
+            'CREATE INDEX IF NOT EXISTS idx_interactions_session_id ON interactions (session_id, id)',
+        ]),
+        (4, "participant sessions and outcomes", [
+            'ALTER TABLE participants ADD COLUMN session_id TEXT',
+            'CREATE UNIQUE INDEX IF NOT EXISTS idx_participants_session_id ON participants (session_id)',
+            # 介入後の測定結果
+            '''
+            CREATE TABLE IF NOT EXISTS outcomes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                participant_id INTEGER NOT NULL UNIQUE,
+                motivation_change INTEGER,
+                interest_change INTEGER,
+                message_effectiveness INTEGER,
+                behavior_intention TEXT,
+                post_motivation INTEGER,
+                post_interest INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+        ]),
+        (5, "stratified assignment counters", [
+            '''
+            CREATE TABLE IF NOT EXISTS assignment_settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+            ''',
+            # 層ごとの割り当て済み人数（ブロック内の位置を決める）
+            '''
+            CREATE TABLE IF NOT EXISTS assignment_counters (
+                stratum TEXT PRIMARY KEY,
+                assigned INTEGER NOT NULL
+            )
+            ''',
+            # 層×条件ごとの割り当て人数（監視用）
+            '''
+            CREATE TABLE IF NOT EXISTS assignment_arm_counts (
+                stratum TEXT NOT NULL,
+                condition TEXT NOT NULL,
+                assigned INTEGER NOT NULL,
+                PRIMARY KEY (stratum, condition)
+            )
+            ''',
+        ]),
+        (6, "precomputed intervention message bank", [
+            '''
+            CREATE TABLE IF NOT EXISTS message_bank (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                age_group TEXT NOT NULL,
+                occupation_category TEXT NOT NULL,
+                motivation_level INTEGER NOT NULL,
+                condition TEXT NOT NULL,
+                variant INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                model TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (age_group, occupation_category, motivation_level, condition, variant)
+            )
+            ''',
+            # 配信したバリエーション（その場で生成した場合は NULL）
+            'ALTER TABLE outcomes ADD COLUMN message_variant_id INTEGER',
+        ]),
+    ],
+    'motivation_analysis': [
+        (1, "initial schema", [
+            '''
+            CREATE TABLE IF NOT EXISTS user_analyses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                age_group TEXT,
+                occupation TEXT,
+                english_frequency TEXT,
+                past_experience TEXT,
+                personality_traits TEXT,
+                time_availability TEXT,
+                stress_factors TEXT,
+                success_preference TEXT,
+                interest_level INTEGER,
+                concerns TEXT,
+                dream TEXT,
+                motivation_message TEXT,
+                action_plan TEXT
+            )
+            ''',
+        ]),
+    ],
+}
+
+# 頻繁に実行されるクエリと、使われるべきインデックス
+QUERY_PLAN_CHECKS = {
+    'english_learning': [
+        (
+            'SELECT role, content, timestamp FROM chat_history WHERE user_id = ? ORDER BY timestamp ASC',
+            'idx_chat_history_user_timestamp'
+        ),
+        (
+            'SELECT id, role, content, timestamp FROM chat_history WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?',
+            'idx_chat_history_user_id'
+        ),
+        (
+            'SELECT id, role, content, timestamp FROM chat_history WHERE user_id = ? AND id > ? AND id < ? ORDER BY id ASC LIMIT ?',
+            'idx_chat_history_user_id'
+        ),
+        (
+            'SELECT activity, progress_score, date FROM learning_progress WHERE user_id = ? ORDER BY date ASC',
+            'idx_learning_progress_user_date'
+        ),
+    ],
+    'behavior_research': [
+        (
+            'SELECT interaction_type, response_time_ms FROM interactions WHERE participant_id = ? ORDER BY timestamp ASC',
+            'idx_interactions_participant_timestamp'
+        ),
+        (
+            'SELECT stage, confidence_level FROM behavior_stages WHERE participant_id = ? ORDER BY timestamp ASC',
+            'idx_behavior_stages_participant_timestamp'
+        ),
+        (
+            'SELECT interaction_type, response_time_ms FROM interactions WHERE session_id = ? ORDER BY id ASC',
+            'idx_interactions_session_id'
+        ),
+        (
+            'SELECT id FROM participants WHERE session_id = ?',
+            'idx_participants_session_id'
+        ),
+        (
+            'SELECT id, message FROM message_bank WHERE age_group = ? AND occupation_category = ? AND motivation_level = ? AND condition = ? ORDER BY variant',
+            'sqlite_autoindex_message_bank_1'
+        ),
+    ],
+}
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def get_schema_version(conn):
+    """適用済みの最新バージョンを取得"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def run_migrations(db_path, schema):
+    """未適用のマイグレーションを順に適用（プロセス内では1回だけ実行）"""
+    key = (db_path, schema)
+    if key in _migrated:
+        return
+
+    with _migrate_lock:
+        if key in _migrated:
+            return
+
+        with get_pool(db_path).connection() as conn:
+            for version, description, statements in SCHEMAS[schema]:
+                # 他プロセスと競合しないよう書き込みロックを取ってから確認する
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    if version <= get_schema_version(conn):
+                        conn.rollback()
+                        continue
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(
+                        'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                        (version, description)
+                    )
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+        _migrated.add(key)
+
+
+def explain_query_plan(conn, sql):
+    """EXPLAIN QUERY PLAN の詳細行を取得"""
+    params = (None,) * sql.count('?')
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+
+def check_query_plans(db_path, schema):
+    """インデックスが使われていないクエリを検出し、問題の一覧を返す"""
+    problems = []
+    with get_pool(db_path).connection() as conn:
+        for sql, index_name in QUERY_PLAN_CHECKS.get(schema, []):
+            plan = explain_query_plan(conn, sql)
+            details = ' / '.join(plan)
+            if not any(index_name in detail for detail in plan):
+                problems.append(f"{index_name} が使われていません: {sql} -> {details}")
+            elif any('TEMP B-TREE' in detail for detail in plan):
+                problems.append(f"並べ替えが発生しています: {sql} -> {details}")
+    return problems
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+    import tempfile
+
+    databases = {
+        'english_learning': 'english_learning.db',
+        'motivation': 'motivation.db',
+        'behavior_research': 'behavior_research.db',
+        'motivation_analysis': 'motivation_analysis.db',
+    }
+
+    # --check-plans: 実データに触れず、一時ディレクトリの空DBでスキーマとクエリプランを確認
+    check_only = '--check-plans' in sys.argv
+    workdir = tempfile.mkdtemp() if check_only else '.'
+
+    failures = []
+    for schema, db_name in databases.items():
+        db_path = os.path.join(workdir, db_name)
+        run_migrations(db_path, schema)
+        failures.extend(check_query_plans(db_path, schema))
+
+    for failure in failures:
+        print(failure)
+    print("OK" if not failures else f"{len(failures)}件の問題があります")
+    sys.exit(1 if failures else 0)
@@ -1,62 +1,31 @@
 import streamlit as st
 import json
-import sqlite3
 from datetime import datetime
-from litellm import completion
-import pandas as pd
-import plotly.express as px
+from llm_gateway import get_gateway
+from llm_resilience import fallback_text
+from metrics import traced
+from migrations import run_migrations
+from generation_memo import memoized_generations, finish_page_generation, regenerate_button
 import random
 
 class MotivationApp:
     def __init__(self):
-        self.model = "ollama/hf.co/elyza/Llama-3-ELYZA-JP-8B-GGUF"
-        self.api_base = "http://localhost:11434"
+        self.llm = get_gateway()
+        self.model = self.llm.model
+        self.db_path = 'motivation.db'
         self.init_database()
     
     def init_database(self):
-        """データベースの初期化"""
-        conn = sqlite3.connect('motivation.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                age INTEGER,
-                occupation TEXT,
-                current_situation TEXT,
-                pain_points TEXT,
-                dreams TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS assessments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                missed_opportunities INTEGER,
-                potential_income INTEGER,
-                time_wasted INTEGER,
-                stress_level INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """データベースの初期化（未適用のマイグレーションのみ実行）"""
+        run_migrations(self.db_path, 'motivation')
     
     def get_llm_response(self, messages):
         """LLMからの応答を取得"""
         try:
-            response = completion(
-                model=self.model,
-                messages=messages,
-                api_base=self.api_base
-            )
-            return response.choices[0].message.content
+            return self.llm.complete(messages)
         except Exception as e:
-            return f"エラーが発生しました: {str(e)}"
+            # エラー内容を応答として扱わず、定型文を返す
+            return fallback_text(e)
     
     def calculate_missed_opportunities(self, user_data):
         """失った機会を計算（AI生成）"""
@@ -106,6 +75,12 @@ class MotivationApp:
         
         return self.get_llm_response([{"role": "user", "content": prompt}])
 
+@st.cache_resource
+def get_app():
+    """アプリをプロセス内で共有（再実行のたびに初期化しない）"""
+    return MotivationApp()
+
+@traced('page', app='motivation')
 def show_hook_page():
     """フック：最初の3秒で興味を引く"""
     st.markdown("""
@@ -168,6 +143,7 @@ def show_hook_page():
     </div>
     """, unsafe_allow_html=True)
 
+@traced('page', app='motivation')
 def show_assessment_page():
     """診断ページ：ユーザーの現状を把握"""
     st.markdown("""
@@ -246,10 +222,11 @@ def show_assessment_page():
             st.session_state.page = "results"
             st.rerun()
 
+@traced('page', app='motivation')
 def show_results_page():
     """結果ページ：損失を可視化し、解決策を提示"""
     user_data = st.session_state.get('user_data', {})
-    app = MotivationApp()
+    app = get_app()
     
     # ショッキングな結果を表示
     st.markdown("""
@@ -258,40 +235,51 @@ def show_results_page():
     </div>
     """, unsafe_allow_html=True)
     
-    # AIで個人化された損失計算
-    with st.spinner("あなた専用の診断結果を計算中..."):
-        missed_opportunities = app.calculate_missed_opportunities(user_data)
-    
-    st.markdown(f"""
-    <div style="background: #e74c3c; color: white; padding: 20px; border-radius: 10px; margin: 20px 0;">
-        <h3>📊 あなたの損失分析</h3>
-        <pre style="color: white; font-size: 1.1em;">{missed_opportunities}</pre>
-    </div>
-    """, unsafe_allow_html=True)
+    # 各セクションの表示枠を先に確保し、生成が終わったものから表示する
+    missed_placeholder = st.empty()
+    missed_placeholder.info("⏳ あなた専用の診断結果を計算中...")
     
     # 成功事例で社会的証明
     st.subheader("✨ あなたと同じ職業の成功事例")
-    with st.spinner("成功事例を検索中..."):
-        success_story = app.get_success_story(user_data.get('occupation', '会社員'))
-    
-    st.markdown(f"""
-    <div style="background: #27ae60; color: white; padding: 20px; border-radius: 10px; margin: 20px 0;">
-        <h4>🎉 実際の成功例</h4>
-        <p style="font-size: 1.1em; line-height: 1.6;">{success_story}</p>
-    </div>
-    """, unsafe_allow_html=True)
+    success_placeholder = st.empty()
+    success_placeholder.info("⏳ 成功事例を検索中...")
     
     # 個人化された未来像
     st.subheader("🌟 あなたの理想の未来")
-    with st.spinner("あなたの未来を描画中..."):
-        personalized_dream = app.generate_personalized_dream(user_data)
-    
-    st.markdown(f"""
-    <div style="background: #3498db; color: white; padding: 20px; border-radius: 10px; margin: 20px 0;">
-        <h4>✨ 英語ができるあなたの未来</h4>
-        <p style="font-size: 1.1em; line-height: 1.6;">{personalized_dream}</p>
-    </div>
-    """, unsafe_allow_html=True)
+    dream_placeholder = st.empty()
+    dream_placeholder.info("⏳ あなたの未来を描画中...")
+    
+    # 3つの生成は互いに独立しているため並列に実行
+    generations = memoized_generations("results", user_data, {
+        "missed_opportunities": lambda: app.calculate_missed_opportunities(user_data),
+        "success_story": lambda: app.get_success_story(user_data.get('occupation', '会社員')),
+        "personalized_dream": lambda: app.generate_personalized_dream(user_data),
+    })
+    for name, content in generations:
+        if name == "missed_opportunities":
+            missed_placeholder.markdown(f"""
+            <div style="background: #e74c3c; color: white; padding: 20px; border-radius: 10px; margin: 20px 0;">
+                <h3>📊 あなたの損失分析</h3>
+                <pre style="color: white; font-size: 1.1em;">{content}</pre>
+            </div>
+            """, unsafe_allow_html=True)
+        elif name == "success_story":
+            success_placeholder.markdown(f"""
+            <div style="background: #27ae60; color: white; padding: 20px; border-radius: 10px; margin: 20px 0;">
+                <h4>🎉 実際の成功例</h4>
+                <p style="font-size: 1.1em; line-height: 1.6;">{content}</p>
+            </div>
+            """, unsafe_allow_html=True)
+        elif name == "personalized_dream":
+            dream_placeholder.markdown(f"""
+            <div style="background: #3498db; color: white; padding: 20px; border-radius: 10px; margin: 20px 0;">
+                <h4>✨ 英語ができるあなたの未来</h4>
+                <p style="font-size: 1.1em; line-height: 1.6;">{content}</p>
+            </div>
+            """, unsafe_allow_html=True)
+    finish_page_generation("results")
+    
+    regenerate_button("results", label="🔄 診断結果を再生成")
     
     # 緊急性と行動喚起
     st.markdown("""
@@ -332,6 +320,7 @@ def show_results_page():
     </div>
     """, unsafe_allow_html=True)
 
+@traced('page', app='motivation')
 def show_action_page():
     """行動ページ：具体的な最初のステップ"""
     st.markdown("""
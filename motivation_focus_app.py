@@ -1,63 +1,48 @@
 import streamlit as st
 import json
 from datetime import datetime
-from litellm import completion
-import litellm
+from llm_gateway import get_gateway
+from llm_admission import FallbackText
+from llm_resilience import fallback_text
+from prompts import render, get_template, PREFIX_CACHE_PARAMS
+from semantic_cache import SemanticCache
+from metrics import traced
+from database import execute
+from migrations import run_migrations
+from generation_memo import memoized_generations, finish_page_generation, regenerate_button, stream_to_placeholder, payload_digest
 import random
-import sqlite3
+
+# 「できるだけ長く」と指示する生成の期限（秒、CPUのバックエンドでは既定の期限を超えることがある）
+LONG_FORM_TIMEOUT = 180.0
 
 class MotivationFocusApp:
     def __init__(self):
-        # デフォルトのAPIキー設定
-        litellm.api_key = "ollama"
-        self.model = "ollama/hf.co/elyza/Llama-3-ELYZA-JP-8B-GGUF"
-        self.api_base = "http://localhost:11434"
+        self.llm = get_gateway()
+        self.model = self.llm.model
+        self.db_path = 'motivation_analysis.db'
         self.init_database()
+        # 自由記述が少し違うだけのプロフィールには既存の生成結果を返す
+        self.semantic_cache = SemanticCache('motivation_focus')
     
     def init_database(self):
-        """データベースの初期化"""
-        conn = sqlite3.connect('motivation_analysis.db')
-        cursor = conn.cursor()
-        
-        # 既存のテーブルを削除
-        cursor.execute('DROP TABLE IF EXISTS user_analyses')
-        
-        # 新しいスキーマでテーブルを作成
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_analyses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            age_group TEXT,
-            occupation TEXT,
-            english_frequency TEXT,
-            past_experience TEXT,
-            personality_traits TEXT,
-            time_availability TEXT,
-            stress_factors TEXT,
-            success_preference TEXT,
-            interest_level INTEGER,
-            concerns TEXT,
-            dream TEXT,
-            motivation_message TEXT,
-            action_plan TEXT
-        )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """データベースの初期化（未適用のマイグレーションのみ実行）"""
+        run_migrations(self.db_path, 'motivation_analysis')
     
     def save_analysis_to_database(self, user_data, motivation_message=None, action_plan=None):
-        """分析結果をデータベースに保存"""
-        conn = sqlite3.connect('motivation_analysis.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        """分析結果をデータベースに保存（analysis_id があればその行を更新）"""
+        analysis_id = execute(self.db_path, '''
         INSERT INTO user_analyses (
-            timestamp, age_group, occupation, english_frequency, past_experience,
+            id, timestamp, age_group, occupation, english_frequency, past_experience,
             personality_traits, time_availability, stress_factors, success_preference,
             interest_level, concerns, dream, motivation_message, action_plan
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            motivation_message = excluded.motivation_message,
+            action_plan = excluded.action_plan
+        WHERE user_analyses.motivation_message IS NOT excluded.motivation_message
+            OR user_analyses.action_plan IS NOT excluded.action_plan
         ''', (
+            user_data.get('analysis_id'),
             datetime.now().isoformat(),
             user_data.get('age_group', ''),
             user_data.get('occupation', ''),
@@ -73,87 +58,69 @@ class MotivationFocusApp:
             motivation_message or '',
             action_plan or ''
         ))
-        
-        analysis_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return analysis_id
+        return user_data.get('analysis_id') or analysis_id
     
-    def get_llm_response(self, messages):
+    def get_llm_response(self, messages, **params):
         """LLMからの応答を取得"""
         try:
-            response = completion(
-                model=self.model,
-                messages=messages,
-                api_base=self.api_base
+            return self.llm.complete(
+                messages,
+                **params
+            )
+        except Exception as e:
+            # エラー内容を応答として扱わず、定型文を返す
+            return fallback_text(e)
+    
+    def stream_llm_response(self, messages, **params):
+        """LLMからの応答をストリーミングで取得"""
+        try:
+            yield from self.llm.stream(
+                messages,
+                **params
             )
-            return response.choices[0].message.content
         except Exception as e:
-            st.error(f"エラーが発生しました: {str(e)}")
-            return None
+            yield fallback_text(e)
+    
+    def generate_with_semantic_cache(self, template_name, user_data, stream=False, timeout=None):
+        """プロフィールがほぼ同じユーザーの生成結果があれば再利用し、なければ生成して保存（timeout は呼び出しの期限）"""
+        messages = render(template_name, user_data)
+        # 選択肢などの構造化された項目はすべて完全一致を条件にし、自由記述の項目だけ類似度で比べる
+        profile = get_template(template_name).profile
+        profile_text = profile.values_text(user_data)
+        scope = SemanticCache.scope_key((template_name, self.model) + profile.structured_values(user_data))
+        bypass = self.llm.is_bypassing_cache()
+        if stream:
+            return self.semantic_cache.cached_stream(
+                profile_text,
+                lambda: self.stream_llm_response(messages, timeout=timeout, **PREFIX_CACHE_PARAMS),
+                scope,
+                bypass=bypass
+            )
+        return self.semantic_cache.cached(
+            profile_text,
+            lambda: self.get_llm_response(messages, timeout=timeout, **PREFIX_CACHE_PARAMS),
+            scope,
+            bypass=bypass
+        )
     
-    def generate_personalized_motivation(self, user_data, approach_type):
-        print(user_data)
+    def generate_personalized_motivation(self, user_data, approach_type, stream=False):
         """個人化されたモチベーション向上メッセージ生成"""
-        prompt = f"""
-        回答はすべて日本語で行ってください。
-        以下のユーザーにゴールから逆算する形で、英語学習に前向きになれるようなメッセージングを心理学の視点に基づいてしてください。
-        提供された情報を安直に使わず、ユーザーがどんな思考を持つタイプか、人となりを考えてメッセージングをしてください。
-        基本的にユーザーは英語学習に興味がないものだと思ってください。「なぜ」英語学習が必要なのか。「どうして」英語学習を始めるのか。そこを考えてメッセージングをしてください。
-        一番重要なことは、この人がメッセージングに触発されて、「英語学習を始めたい」という思いを持ってくれることです。
-        学術的で冷静なトーンを保ち、過度な煽りは避けてください。
-
-        また、このメッセージはユーザーに直接表示されるものなので、メタ的な文章は避けてください。
-        直接メッセージをください。
-        メッセージはできるだけ長くしてください。
-        
-        ユーザー情報:
-        - 年齢層: {user_data.get('age_group')}
-        - 職業: {user_data.get('occupation')}
-        - 英語使用頻度: {user_data.get('english_frequency')}
-        - 過去の学習経験: {user_data.get('past_experience')}
-        - 性格傾向: {user_data.get('personality_traits')}
-        - 時間的余裕: {user_data.get('time_availability')}
-        - ストレス要因: {user_data.get('stress_factors')}
-        - 現在の関心度: {user_data.get('interest_level')}/10
-        - 悩み: {user_data.get('concerns')}
-        - 将来の夢: {user_data.get('dream')}
-        """
-        
-        return self.get_llm_response([{"role": "user", "content": prompt}])
+        return self.generate_with_semantic_cache(
+            'motivation_focus.personalized_motivation', user_data, stream, timeout=LONG_FORM_TIMEOUT
+        )
     
-    def generate_next_step_guidance(self, user_data):
+    def generate_next_step_guidance(self, user_data, stream=False):
         """次のステップガイダンス生成"""
-        prompt = f"""
-        回答はすべて日本語で行ってください。
-        以下のユーザーが英語学習を今日から始めるための、超具体的で実行しやすい「最初の一歩」を提案してください。
-        また、このメッセージはユーザーに直接表示されるものなので、メタ的な文章は避けてください。
-        ユーザー情報:
-        - 年齢層: {user_data.get('age_group')}
-        - 職業: {user_data.get('occupation')}
-        - 英語使用頻度: {user_data.get('english_frequency')}
-        - 過去の学習経験: {user_data.get('past_experience')}
-        - 性格傾向: {user_data.get('personality_traits')}
-        - 時間的余裕: {user_data.get('time_availability')}
-        - ストレス要因: {user_data.get('stress_factors')}
-        - 現在の関心度: {user_data.get('interest_level')}/10
-        - 悩み: {user_data.get('concerns')}
-        - 将来の夢: {user_data.get('dream')}
-        
-        以下の条件を満たしてください：
-        1. 今日中に実行できる
-        2. この人の時間的余裕に合わせて5-15分以内で完了する
-        3. この人の性格や過去の経験を考慮する
-        4. 成功体験を感じられる
-        5. 継続につながりやすい
-        
-        具体的なアクションプランを3つ提示してください。
-        """
-        
-        return self.get_llm_response([{"role": "user", "content": prompt}])
+        # モチベーションメッセージと共通の先頭部分（指示＋ユーザー情報）を使い、KVキャッシュを再利用する
+        return self.generate_with_semantic_cache('motivation_focus.next_step_guidance', user_data, stream)
+
 
+@st.cache_resource
+def get_app():
+    """アプリをプロセス内で共有（再実行のたびに初期化しない）"""
+    return MotivationFocusApp()
 
+@traced('page', app='motivation_focus')
 def show_assessment_page():
     """詳細分析ページ"""
     st.markdown("""
@@ -396,7 +363,7 @@ def show_assessment_page():
         }
         
         # AIでバックグラウンド分析を実行
-        app = MotivationFocusApp()
+        app = get_app()
         
         # データベースに分析結果を保存
         analysis_id = app.save_analysis_to_database(user_data)
@@ -407,47 +374,76 @@ def show_assessment_page():
         st.rerun()
 
 
+@traced('page', app='motivation_focus')
 def show_motivation_page():
     """モチベーション向上ページ"""
     user_data = st.session_state.get('user_data', {})
-    app = MotivationFocusApp()
+    app = get_app()
     
     st.markdown(f"""
     # 英語学習を始めてみませんか？
     """)
     
     # パーソナライズされたモチベーションメッセージ
-    with st.spinner("最適化中..."):
-        motivation_message = app.generate_personalized_motivation(user_data, "loss_aversion")
-    
-    st.markdown(f"""
-    <div style="background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%); color: white; padding: 25px; border-radius: 15px; margin: 20px 0;">
-        <h3 style="margin-bottom: 15px;">💡 あなたへのメッセージ</h3>
-        <div style="background: rgba(255,255,255,0.1); padding: 20px; border-radius: 10px; line-height: 1.8;">
-            {motivation_message.replace(chr(10), '<br>')}
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    motivation_placeholder = st.empty()
+    motivation_placeholder.info("⏳ 最適化中...")
     
     # 次のステップ
     st.markdown("---")
     st.subheader("あなた専用の実行プラン")
+    next_steps_placeholder = st.empty()
+    next_steps_placeholder.info("⏳ あなたの状況に最適化されたアクションプランを作成中...")
     
-    with st.spinner("あなたの状況に最適化されたアクションプランを作成中..."):
-        next_steps = app.generate_next_step_guidance(user_data)
+    # 2つの生成は互いに独立しているため並列に実行し、トークンを逐次表示
+    results = {}
+    generations = memoized_generations("motivation", user_data, {
+        "motivation_message": lambda: stream_to_placeholder(
+            motivation_placeholder,
+            app.generate_personalized_motivation(user_data, "loss_aversion", stream=True)
+        ),
+        "next_steps": lambda: stream_to_placeholder(
+            next_steps_placeholder,
+            app.generate_next_step_guidance(user_data, stream=True)
+        ),
+    })
+    for name, content in generations:
+        results[name] = content
+        if content is None:
+            continue
+        if isinstance(content, FallbackText):
+            # 生成できなかった場合は定型文を表示し、保存もしない
+            (motivation_placeholder if name == "motivation_message" else next_steps_placeholder).warning(content)
+            continue
+        if name == "motivation_message":
+            motivation_placeholder.markdown(f"""
+            <div style="background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%); color: white; padding: 25px; border-radius: 15px; margin: 20px 0;">
+                <h3 style="margin-bottom: 15px;">💡 あなたへのメッセージ</h3>
+                <div style="background: rgba(255,255,255,0.1); padding: 20px; border-radius: 10px; line-height: 1.8;">
+                    {content.replace(chr(10), '<br>')}
+                </div>
+            </div>
+            """, unsafe_allow_html=True)
+        elif name == "next_steps":
+            next_steps_placeholder.markdown(f"""
+            <div style="background: #2ecc71; color: white; padding: 25px; border-radius: 15px; margin: 20px 0;">
+                <h3 style="margin-bottom: 15px;">📋 今日から始められるアクション</h3>
+                <div style="background: rgba(255,255,255,0.1); padding: 20px; border-radius: 10px; line-height: 1.8;">
+                    {content.replace(chr(10), '<br>')}
+                </div>
+            </div>
+            """, unsafe_allow_html=True)
+    finish_page_generation("motivation")
     
-    # データベースにモチベーションメッセージとアクションプランを更新保存
-    if 'analysis_id' in user_data:
-        app.save_analysis_to_database(user_data, motivation_message, next_steps)
+    # データベースにモチベーションメッセージとアクションプランを更新保存（内容が変わったときだけ）
+    if 'analysis_id' in user_data and not any(
+        content is None or isinstance(content, FallbackText) for content in results.values()
+    ):
+        saved_digest = payload_digest([user_data['analysis_id'], results])
+        if st.session_state.get('saved_analysis_digest') != saved_digest:
+            app.save_analysis_to_database(user_data, results.get("motivation_message"), results.get("next_steps"))
+            st.session_state.saved_analysis_digest = saved_digest
     
-    st.markdown(f"""
-    <div style="background: #2ecc71; color: white; padding: 25px; border-radius: 15px; margin: 20px 0;">
-        <h3 style="margin-bottom: 15px;">📋 今日から始められるアクション</h3>
-        <div style="background: rgba(255,255,255,0.1); padding: 20px; border-radius: 10px; line-height: 1.8;">
-            {next_steps.replace(chr(10), '<br>')}
-        </div>
-    </div>
-    """, unsafe_allow_html=True)
+    regenerate_button("motivation")
     
     # リスタート
     st.markdown("---")
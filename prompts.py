@@ -0,0 +1,169 @@
+import string
+import textwrap
+
+# 同じユーザーへの連続した呼び出しでOllamaのKVキャッシュ（共通の先頭部分）を再利用できるよう、モデルを常駐させる時間
+KEEP_ALIVE = "30m"
+
+# プロンプトと一緒に送るパラメータ
+PREFIX_CACHE_PARAMS = {'keep_alive': KEEP_ALIVE}
+
+
+def _compile(text):
+    """テンプレート文字列を整形し、埋め込む変数名を取り出す"""
+    text = textwrap.dedent(text).strip()
+    fields = {name for _, name, _, _ in string.Formatter().parse(text) if name}
+    return text, fields
+
+
+class ProfileBlock:
+    """プロンプトの共通の先頭部分（安定した指示＋ユーザー情報）"""
+
+    def __init__(self, name, instructions, fields, free_text=()):
+        self.name = name
+        self.instructions, _ = _compile(instructions)
+        # (表示名, キー, 接尾辞) の順序は固定し、同じユーザーなら常に同じ文字列になるようにする
+        self.fields = list(fields)
+        # 自由記述の項目（それ以外は選択肢などの構造化された項目）
+        self.free_text = set(free_text)
+        self._format = "ユーザー情報:\n" + "\n".join(
+            f"- {label}: {{{i}}}{suffix}" for i, (label, _, suffix) in enumerate(self.fields)
+        )
+
+    def render(self, user_data):
+        values = [user_data.get(key) for _, key, _ in self.fields]
+        return f"{self.instructions}\n\n{self._format.format(*values)}"
+
+    def values_text(self, user_data):
+        """類似度の比較用に自由記述の項目の値だけを並べた文字列（共通の見出しで類似度が底上げされないように）"""
+        return "\n".join(str(user_data.get(key)) for _, key, _ in self.fields if key in self.free_text)
+
+    def structured_values(self, user_data):
+        """自由記述以外の項目の値（生成結果の再利用には完全一致を条件にする）"""
+        return tuple(user_data.get(key) for _, key, _ in self.fields if key not in self.free_text)
+
+
+class PromptTemplate:
+    """共通の先頭部分（system）と課題ごとの指示（user）からなるプロンプト"""
+
+    def __init__(self, name, profile, task):
+        self.name = name
+        self.profile = profile
+        self.task, self.fields = _compile(task)
+
+    def render(self, user_data, **variables):
+        """LLMに送るメッセージ列を作成"""
+        missing = self.fields - variables.keys()
+        if missing:
+            raise KeyError(f"{self.name}: {', '.join(sorted(missing))} が指定されていません")
+        return [
+            {"role": "system", "content": self.profile.render(user_data)},
+            {"role": "user", "content": self.task.format(**variables)},
+        ]
+
+
+_templates = {}
+
+
+def register(template):
+    """テンプレートを登録（起動時に一度だけ整形される）"""
+    if template.name in _templates:
+        raise ValueError(f"テンプレート {template.name} は登録済みです")
+    _templates[template.name] = template
+    return template
+
+
+def get_template(name):
+    """登録済みのテンプレートを取得"""
+    return _templates[name]
+
+
+def render(name, user_data, **variables):
+    """登録済みのテンプレートからメッセージ列を作成"""
+    return get_template(name).render(user_data, **variables)
+
+
+MOTIVATION_PROFILE = ProfileBlock(
+    'motivation_focus',
+    """
+    回答はすべて日本語で行ってください。
+    あなたは心理学に基づいて英語学習への動機づけを支援する専門家です。
+    基本的にユーザーは英語学習に興味がないものだと思ってください。
+    あなたのメッセージはユーザーに直接表示されるものなので、メタ的な文章は避けてください。
+    """,
+    [
+        ("年齢層", 'age_group', ""),
+        ("職業", 'occupation', ""),
+        ("英語使用頻度", 'english_frequency', ""),
+        ("過去の学習経験", 'past_experience', ""),
+        ("性格傾向", 'personality_traits', ""),
+        ("時間的余裕", 'time_availability', ""),
+        ("ストレス要因", 'stress_factors', ""),
+        ("現在の関心度", 'interest_level', "/10"),
+        ("悩み", 'concerns', ""),
+        ("将来の夢", 'dream', ""),
+    ],
+    free_text=('concerns', 'dream')
+)
+
+LEARNER_PROFILE = ProfileBlock(
+    'learner',
+    """
+    出力はすべて日本語で行ってください。
+    あなたはユーザーに合わせて英語学習を設計するコーチです。
+    """,
+    [
+        ("年齢", 'age', ""),
+        ("職業", 'occupation', ""),
+        ("英語レベル", 'english_level', ""),
+        ("目標", 'goal', ""),
+        ("興味のある分野", 'interests', ""),
+    ]
+)
+
+register(PromptTemplate('motivation_focus.personalized_motivation', MOTIVATION_PROFILE, """
+    上記のユーザーにゴールから逆算する形で、英語学習に前向きになれるようなメッセージングを心理学の視点に基づいてしてください。
+    提供された情報を安直に使わず、ユーザーがどんな思考を持つタイプか、人となりを考えてメッセージングをしてください。
+    「なぜ」英語学習が必要なのか。「どうして」英語学習を始めるのか。そこを考えてメッセージングをしてください。
+    一番重要なことは、この人がメッセージングに触発されて、「英語学習を始めたい」という思いを持ってくれることです。
+    学術的で冷静なトーンを保ち、過度な煽りは避けてください。
+
+    直接メッセージをください。
+    メッセージはできるだけ長くしてください。
+"""))
+
+register(PromptTemplate('motivation_focus.next_step_guidance', MOTIVATION_PROFILE, """
+    上記のユーザーが英語学習を今日から始めるための、超具体的で実行しやすい「最初の一歩」を提案してください。
+
+    以下の条件を満たしてください：
+    1. 今日中に実行できる
+    2. この人の時間的余裕に合わせて5-15分以内で完了する
+    3. この人の性格や過去の経験を考慮する
+    4. 成功体験を感じられる
+    5. 継続につながりやすい
+
+    具体的なアクションプランを3つ提示してください。
+"""))
+
+register(PromptTemplate('struction.personalized_message', LEARNER_PROFILE, """
+    上記のユーザー情報に基づいて、英語学習を始めるための励ましのメッセージを生成してください。
+    基本的に、英語学習に興味がないユーザーと想定し、「英語を始めたい！！」という風に思わせるようなメッセージを生成してください。
+
+    以下の要素を含めてください：
+    1. 「英語を始めたい！！」という風に思わせるような事実の羅列、英語を学んだことで成功した人、物事の引用
+    2. ユーザーの状況に合わせた具体的な目標設定
+    3. 最初の一歩としての具体的なアクション
+    4. モチベーションを高める励ましの言葉
+    5. ゴールを提示する
+
+    また、英語学習に興味がないユーザーと想定し、「英語を始めたい！！」という風に思わせるようなメッセージが一番重要です。ここに力を入れてください。
+"""))
+
+register(PromptTemplate('struction.learning_path', LEARNER_PROFILE, """
+    上記のユーザー情報に基づいて、英語学習のロードマップを生成してください。
+
+    以下の要素を含めてください：
+    1. 短期目標（1ヶ月）
+    2. 中期目標（3ヶ月）
+    3. 長期目標（6ヶ月）
+    4. 各目標達成のための具体的なアクションプラン
+"""))
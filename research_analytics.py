@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+from database import get_pool
+
+CONDITIONS = ["loss_aversion", "social_proof", "implementation_intention"]
+STAGES = ["precontemplation", "contemplation", "preparation", "action", "maintenance"]
+
+# 効果量を計算する変化量の列
+CHANGE_METRICS = ["motivation_change", "interest_change"]
+
+# ブートストラップ1回分の配列の要素数の上限（メモリ使用量を抑えるため分割して計算）
+BOOTSTRAP_CHUNK_ELEMENTS = 20_000_000
+
+
+def load_frames(db_path):
+    """参加者×結果、行動段階の前後、参加者ごとの操作集計を DataFrame で読み込む"""
+    with get_pool(db_path).connection() as conn:
+        participants = pd.read_sql_query('''
+            SELECT p.id AS participant_id, p.age_group, p.occupation_category, p.experiment_group,
+                   p.english_motivation_level, p.initial_interest_score,
+                   o.motivation_change, o.interest_change, o.message_effectiveness,
+                   o.post_motivation, o.post_interest, o.behavior_intention
+            FROM participants p
+            JOIN outcomes o ON o.participant_id = p.id
+        ''', conn)
+        stages = pd.read_sql_query('''
+            SELECT participant_id, stage, trigger_type FROM behavior_stages
+        ''', conn)
+        interactions = pd.read_sql_query('''
+            SELECT participant_id,
+                   COUNT(*) AS events,
+                   SUM(CASE WHEN interaction_type = 'control_change' THEN 1 ELSE 0 END) AS control_changes,
+                   AVG(CASE WHEN interaction_type = 'control_change' THEN response_time_ms END) AS mean_response_time_ms,
+                   SUM(CASE WHEN interaction_type = 'page_exit' THEN response_time_ms ELSE 0 END) AS total_dwell_ms
+            FROM interactions
+            WHERE participant_id IS NOT NULL
+            GROUP BY participant_id
+        ''', conn)
+    # 集計値が NULL だけの列も数値型としてそろえる
+    interactions = interactions.apply(pd.to_numeric)
+
+    is_baseline = stages['trigger_type'] == 'baseline'
+    transitions = (
+        stages[is_baseline][['participant_id', 'stage']].rename(columns={'stage': 'baseline_stage'})
+        .merge(
+            stages[~is_baseline][['participant_id', 'stage']].rename(columns={'stage': 'post_stage'}),
+            on='participant_id'
+        )
+    )
+    participants = (
+        participants
+        .merge(transitions, on='participant_id', how='left')
+        .merge(interactions, on='participant_id', how='left')
+    )
+    participants['experiment_group'] = pd.Categorical(participants['experiment_group'], categories=CONDITIONS)
+    return participants
+
+
+def effect_sizes(frame, metrics=CHANGE_METRICS):
+    """条件ごとの前後変化の平均と効果量（対応のある d_z = 平均 / 標準偏差）"""
+    grouped = frame.groupby('experiment_group', observed=False)[list(metrics)]
+    mean = grouped.mean()
+    std = grouped.std(ddof=1)
+    count = grouped.count()
+    d_z = mean / std.replace(0, np.nan)
+
+    table = pd.concat({'n': count, 'mean': mean, 'std': std, 'd_z': d_z}, axis=1)
+    # (統計量, 指標) → (指標, 統計量) の列順にそろえる
+    return table.swaplevel(axis=1).sort_index(axis=1, level=0)
+
+
+def bootstrap_ci(values, n_resamples=2000, confidence=0.95, seed=None):
+    """平均と d_z のブートストラップ信頼区間（リサンプルは行列演算でまとめて計算）"""
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    n = len(values)
+    if n < 2:
+        return {'mean': (np.nan, np.nan), 'd_z': (np.nan, np.nan)}
+
+    rng = np.random.default_rng(seed)
+    unique, counts = np.unique(values, return_counts=True)
+    if len(unique) * 10 <= n:
+        # 値の種類が少ない（リッカート尺度の差など）場合は各値の出現回数を多項分布から引く
+        drawn = rng.multinomial(n, counts / n, size=n_resamples)
+        means = drawn @ unique / n
+        sum_squares = drawn @ (unique ** 2)
+        stds = np.sqrt(np.maximum(sum_squares - n * means ** 2, 0) / (n - 1))
+    else:
+        chunk = max(1, min(n_resamples, BOOTSTRAP_CHUNK_ELEMENTS // n))
+        means = np.empty(n_resamples)
+        stds = np.empty(n_resamples)
+        for start in range(0, n_resamples, chunk):
+            size = min(chunk, n_resamples - start)
+            samples = values[rng.integers(0, n, size=(size, n))]
+            means[start:start + size] = samples.mean(axis=1)
+            stds[start:start + size] = samples.std(axis=1, ddof=1)
+
+    alpha = (1 - confidence) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d_z = np.where(stds > 0, means / stds, np.nan)
+    return {
+        'mean': tuple(np.quantile(means, [alpha, 1 - alpha])),
+        'd_z': tuple(np.nanquantile(d_z, [alpha, 1 - alpha])) if np.isfinite(d_z).any() else (np.nan, np.nan),
+    }
+
+
+def bootstrap_table(frame, metric='motivation_change', n_resamples=2000, confidence=0.95, seed=None):
+    """条件ごとの平均・d_z とそのブートストラップ信頼区間"""
+    rows = []
+    for condition in CONDITIONS:
+        values = frame.loc[frame['experiment_group'] == condition, metric].to_numpy(dtype=float)
+        values = values[~np.isnan(values)]
+        ci = bootstrap_ci(values, n_resamples, confidence, seed)
+        std = values.std(ddof=1) if len(values) > 1 else np.nan
+        rows.append({
+            'experiment_group': condition,
+            'n': len(values),
+            'mean': values.mean() if len(values) else np.nan,
+            'mean_low': ci['mean'][0],
+            'mean_high': ci['mean'][1],
+            'd_z': values.mean() / std if len(values) > 1 and std > 0 else np.nan,
+            'd_z_low': ci['d_z'][0],
+            'd_z_high': ci['d_z'][1],
+        })
+    return pd.DataFrame(rows).set_index('experiment_group')
+
+
+def transition_matrices(frame, normalize=True):
+    """条件ごとの行動段階の遷移行列（行: ベースライン、列: 介入後）"""
+    condition = pd.Categorical(frame['experiment_group'], categories=CONDITIONS).codes
+    baseline = pd.Categorical(frame['baseline_stage'], categories=STAGES).codes
+    post = pd.Categorical(frame['post_stage'], categories=STAGES).codes
+    valid = (condition >= 0) & (baseline >= 0) & (post >= 0)
+
+    # (条件, 前, 後) の組を1次元の番号にして一度に数える
+    size = len(STAGES)
+    flat = (condition[valid].astype(np.int64) * size + baseline[valid]) * size + post[valid]
+    counts = np.bincount(flat, minlength=len(CONDITIONS) * size * size).reshape(len(CONDITIONS), size, size)
+    if normalize:
+        totals = counts.sum(axis=2, keepdims=True)
+        counts = np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+
+    matrices = {}
+    for i, name in enumerate(CONDITIONS):
+        matrix = pd.DataFrame(counts[i], index=STAGES, columns=STAGES)
+        matrix.index.name = 'baseline'
+        matrix.columns.name = 'post'
+        matrices[name] = matrix
+    return matrices
+
+
+def stage_progression(frame):
+    """条件ごとの段階が進んだ・変わらない・後退した参加者の割合"""
+    frame = frame.dropna(subset=['baseline_stage', 'post_stage'])
+    order = {stage: i for i, stage in enumerate(STAGES)}
+    delta = np.sign(frame['post_stage'].map(order) - frame['baseline_stage'].map(order))
+    labels = delta.map({1: '前進', 0: '変化なし', -1: '後退'})
+    return pd.crosstab(frame['experiment_group'], labels, normalize='index').reindex(CONDITIONS).fillna(0.0)
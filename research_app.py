@@ -1,88 +1,42 @@
 import streamlit as st
 import json
-import sqlite3
 from datetime import datetime, timedelta
-from litellm import completion
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import random
+from llm_gateway import get_gateway
+from llm_admission import FallbackText
+from llm_resilience import fallback_text
+from metrics import traced
+from migrations import run_migrations
+from generation_memo import memoized_generation, finish_page_generation, regenerate_button
+from research_events import get_event_buffer, track_page_view, track_control, track_click, change_page, utc_timestamp
+from research_store import get_writer
+from research_assignment import StratifiedAssigner
+from research_message_bank import MessageBank, AGE_GROUPS, OCCUPATION_CATEGORIES, CANNED_MESSAGES
 
 class BehaviorChangeResearch:
     def __init__(self):
-        self.model = "ollama/hf.co/elyza/Llama-3-ELYZA-JP-8B-GGUF"
-        self.api_base = "http://localhost:11434"
+        self.llm = get_gateway()
+        self.model = self.llm.model
+        self.db_path = 'behavior_research.db'
         self.init_database()
+        self.assigner = StratifiedAssigner(self.db_path)
+        self.message_bank = MessageBank(self.db_path)
     
     def init_database(self):
-        """研究用データベースの初期化"""
-        conn = sqlite3.connect('behavior_research.db')
-        cursor = conn.cursor()
-        
-        # 参加者情報
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS participants (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                age_group TEXT,
-                occupation_category TEXT,
-                english_motivation_level INTEGER,
-                initial_interest_score INTEGER,
-                experiment_group TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 行動変容段階（Transtheoretical Model）
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS behavior_stages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                participant_id INTEGER,
-                stage TEXT, -- precontemplation, contemplation, preparation, action, maintenance
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                trigger_type TEXT,
-                confidence_level INTEGER
-            )
-        ''')
-        
-        # インタラクション記録
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS interactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                participant_id INTEGER,
-                interaction_type TEXT,
-                content TEXT,
-                response_time_ms INTEGER,
-                engagement_score INTEGER,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # 実験条件
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS experimental_conditions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                condition_name TEXT,
-                description TEXT,
-                psychological_principle TEXT
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        """研究用データベースの初期化（未適用のマイグレーションのみ実行）"""
+        run_migrations(self.db_path, 'behavior_research')
     
-    def get_llm_response(self, messages):
+    def get_llm_response(self, messages, **params):
         """LLMからの応答を取得"""
         try:
-            response = completion(
-                model=self.model,
-                messages=messages,
-                api_base=self.api_base
+            return self.llm.complete(
+                messages,
+                **params
             )
-            return response.choices[0].message.content
         except Exception as e:
-            return f"エラーが発生しました: {str(e)}"
+            # エラー内容を応答として扱わず、定型文を返す
+            return fallback_text(e)
     
-    def generate_personalized_insight(self, participant_data, condition):
+    def generate_personalized_insight(self, participant_data, condition, **params):
         """実験条件に基づく個人化されたインサイト生成"""
         
         if condition == "loss_aversion":
@@ -136,8 +90,14 @@ class BehaviorChangeResearch:
             3. 障壁への対処法
             """
         
-        return self.get_llm_response([{"role": "user", "content": prompt}])
+        return self.get_llm_response([{"role": "user", "content": prompt}], **params)
+
+@st.cache_resource
+def get_research():
+    """研究用インスタンスをプロセス内で共有（再実行のたびに初期化しない）"""
+    return BehaviorChangeResearch()
 
+@traced('page', app='research')
 def show_consent_page():
     """研究参加同意書"""
     st.markdown("""
@@ -166,17 +126,22 @@ def show_consent_page():
     """)
     
     col1, col2 = st.columns([3, 1])
+    research = get_research()
     with col1:
-        consent = st.checkbox("上記の内容を理解し、研究に参加することに同意します")
+        consent = st.checkbox(
+            "上記の内容を理解し、研究に参加することに同意します",
+            key="consent",
+            on_change=track_control(research.db_path, "consent")
+        )
     
     with col2:
         if consent and st.button("研究に参加", type="primary"):
-            # ランダムに実験グループを割り当て
-            groups = ["loss_aversion", "social_proof", "implementation_intention"]
-            st.session_state.experiment_group = random.choice(groups)
-            st.session_state.page = "baseline"
+            # 実験グループは層（年齢層×職業）が分かるベースライン調査の送信時に割り当てる
+            track_click(research.db_path, "join")
+            change_page(research.db_path, "baseline")
             st.rerun()
 
+@traced('page', app='research')
 def show_baseline_assessment():
     """ベースライン測定"""
     st.markdown("""
@@ -190,11 +155,9 @@ def show_baseline_assessment():
         
         col1, col2 = st.columns(2)
         with col1:
-            age_group = st.selectbox("年齢層", ["18-24", "25-34", "35-44", "45-54", "55+"])
+            age_group = st.selectbox("年齢層", AGE_GROUPS)
         with col2:
-            occupation = st.selectbox("職業カテゴリ", [
-                "学生", "技術職", "事務職", "営業職", "管理職", "専門職", "その他"
-            ])
+            occupation = st.selectbox("職業カテゴリ", OCCUPATION_CATEGORIES)
         
         st.subheader("📈 現在の状況")
         
@@ -240,15 +203,23 @@ def show_baseline_assessment():
                 'confidence': confidence
             }
             st.session_state.participant_data = participant_data
-            st.session_state.page = "intervention"
+            st.session_state.baseline_at = utc_timestamp()
+            research = get_research()
+            if 'experiment_group' not in st.session_state:
+                # 層別ブロックランダム化で実験グループを割り当て
+                st.session_state.experiment_group = research.assigner.assign(age_group, occupation)
+            db_path = research.db_path
+            track_click(db_path, "baseline_form", interaction_type='form_submit')
+            change_page(db_path, "intervention")
             st.rerun()
 
+@traced('page', app='research')
 def show_intervention_page():
     """実験介入"""
     participant_data = st.session_state.get('participant_data', {})
     experiment_group = st.session_state.get('experiment_group', 'loss_aversion')
     
-    research = BehaviorChangeResearch()
+    research = get_research()
     
     # 実験グループの説明
     group_names = {
@@ -264,9 +235,32 @@ def show_intervention_page():
     以下のメッセージをお読みください。
     """)
     
+    def serve_message():
+        # 事前生成バンクにあれば即座に配信し、なければその場で生成
+        served = research.message_bank.pick(participant_data, experiment_group)
+        source = 'bank'
+        if served is None:
+            message = research.generate_personalized_insight(participant_data, experiment_group)
+            source = 'live'
+            if isinstance(message, FallbackText):
+                # 生成できないときは条件ごとの定型メッセージを配信（どのメッセージを見たかは source で区別する）
+                message = CANNED_MESSAGES[experiment_group]
+                source = 'canned'
+            served = {'variant_id': None, 'message': message}
+        get_event_buffer(research.db_path).record(
+            'message_served', 'insight', {'variant_id': served['variant_id'], 'source': source}
+        )
+        return served
+    
     # AIによる個人化されたメッセージ生成
     with st.spinner("あなた専用のメッセージを生成中..."):
-        personalized_message = research.generate_personalized_insight(participant_data, experiment_group)
+        served = memoized_generation(
+            "intervention", "insight",
+            {'participant_data': participant_data, 'experiment_group': experiment_group},
+            serve_message
+        )
+    finish_page_generation("intervention")
+    personalized_message = served['message']
     
     st.markdown(f"""
     ## 📝 あなたへのメッセージ
@@ -276,6 +270,8 @@ def show_intervention_page():
     </div>
     """, unsafe_allow_html=True)
     
+    regenerate_button("intervention")
+    
     # 反応の測定
     st.markdown("---")
     st.subheader("📊 あなたの反応")
@@ -286,20 +282,26 @@ def show_intervention_page():
         post_motivation = st.slider(
             "このメッセージを読んだ後の英語学習に対するモチベーション",
             min_value=1, max_value=10, value=participant_data.get('motivation_level', 5),
-            help="1: 全く興味がない ～ 10: 非常に興味がある"
+            help="1: 全く興味がない ～ 10: 非常に興味がある",
+            key="post_motivation",
+            on_change=track_control(research.db_path, "post_motivation")
         )
     
     with col2:
         post_interest = st.slider(
             "このメッセージを読んだ後の英語学習を始める可能性",
             min_value=1, max_value=10, value=participant_data.get('interest_score', 5),
-            help="1: 絶対に始めない ～ 10: すぐに始める"
+            help="1: 絶対に始めない ～ 10: すぐに始める",
+            key="post_interest",
+            on_change=track_control(research.db_path, "post_interest")
         )
     
     message_effectiveness = st.slider(
         "このメッセージの説得力",
         min_value=1, max_value=10, value=5,
-        help="1: 全く説得力がない ～ 10: 非常に説得力がある"
+        help="1: 全く説得力がない ～ 10: 非常に説得力がある",
+        key="message_effectiveness",
+        on_change=track_control(research.db_path, "message_effectiveness")
     )
     
     behavior_intention = st.radio(
@@ -310,7 +312,9 @@ def show_intervention_page():
             "具体的な学習方法を調べてみる", 
             "今日中に学習を始める",
             "学習計画を立ててすぐに始める"
-        ]
+        ],
+        key="behavior_intention",
+        on_change=track_control(research.db_path, "behavior_intention")
     )
     
     if st.button("結果を送信", type="primary"):
@@ -326,11 +330,29 @@ def show_intervention_page():
             'post_motivation': post_motivation,
             'post_interest': post_interest
         }
+        # 参加者・段階・結果・残りのイベントを1トランザクションで書き込むよう予約
+        buffer = get_event_buffer(research.db_path)
+        buffer.record('button_click', "submit_results")
+        buffer.page_exit()
+        get_writer(research.db_path).submit_participant({
+            'session_id': buffer.session_id,
+            'participant_data': participant_data,
+            'experiment_group': experiment_group,
+            'results': st.session_state.results,
+            'message_variant_id': served['variant_id'],
+            'baseline_at': st.session_state.get('baseline_at') or utc_timestamp(),
+            'submitted_at': utc_timestamp(),
+            'events': buffer.take(),
+        })
         st.session_state.page = "results"
         st.rerun()
 
+@traced('page', app='research')
 def show_results_page():
     """研究結果の表示"""
+    # plotly は読み込みに時間がかかるため、グラフを描くページで読み込む
+    import plotly.graph_objects as go
+    
     participant_data = st.session_state.get('participant_data', {})
     results = st.session_state.get('results', {})
     experiment_group = st.session_state.get('experiment_group', '')
@@ -432,8 +454,101 @@ def show_results_page():
     )
     
     if st.button("フィードバックを送信"):
+        buffer = get_event_buffer(get_research().db_path)
+        buffer.record('feedback_submit', 'feedback', len(feedback))
+        buffer.flush()
         st.success("フィードバックをありがとうございました！")
 
+@st.cache_data(ttl=60, show_spinner=False)
+def load_analytics_frame(db_path):
+    """分析用のデータを読み込む（1分間は再実行で読み直さない）"""
+    from research_analytics import load_frames
+    return load_frames(db_path)
+
+@traced('page', app='research')
+def show_dashboard_page():
+    """研究者ダッシュボード（全参加者の条件別分析）"""
+    # pandas・plotly を使う分析は参加者向けのページでは読み込まない
+    import plotly.express as px
+    import plotly.graph_objects as go
+    from research_analytics import effect_sizes, bootstrap_table, transition_matrices, stage_progression, CHANGE_METRICS
+    
+    st.markdown("# 📈 研究者ダッシュボード")
+    
+    db_path = get_research().db_path
+    if st.button("↩️ 実験画面に戻る"):
+        change_page(db_path, st.session_state.pop('dashboard_return_page', "consent"))
+        st.rerun()
+    
+    frame = load_analytics_frame(db_path)
+    if frame.empty:
+        st.info("まだ結果を送信した参加者がいません。")
+        return
+    
+    group_names = {
+        "loss_aversion": "損失回避",
+        "social_proof": "社会的証明",
+        "implementation_intention": "実装意図"
+    }
+    metric_names = {
+        "motivation_change": "モチベーション変化",
+        "interest_change": "学習意欲変化"
+    }
+    
+    counts = frame['experiment_group'].value_counts()
+    cols = st.columns(len(group_names) + 1)
+    cols[0].metric("参加者数", len(frame))
+    for col, (group, name) in zip(cols[1:], group_names.items()):
+        col.metric(name, int(counts.get(group, 0)))
+    
+    # 条件別の効果量とブートストラップ信頼区間
+    st.subheader("🧪 条件別の効果")
+    col1, col2 = st.columns(2)
+    with col1:
+        metric = st.selectbox("指標", CHANGE_METRICS, format_func=metric_names.get)
+    with col2:
+        n_resamples = st.select_slider("ブートストラップ回数", options=[500, 1000, 2000, 5000], value=2000)
+    
+    table = bootstrap_table(frame, metric, n_resamples=n_resamples, seed=0)
+    fig = go.Figure(go.Bar(
+        x=[group_names[group] for group in table.index],
+        y=table['mean'],
+        error_y=dict(
+            type='data',
+            symmetric=False,
+            array=table['mean_high'] - table['mean'],
+            arrayminus=table['mean'] - table['mean_low']
+        ),
+        marker_color='darkblue'
+    ))
+    fig.update_layout(title=f"{metric_names[metric]}の平均（95%信頼区間）", height=400)
+    st.plotly_chart(fig, use_container_width=True)
+    st.dataframe(table.round(3), use_container_width=True)
+    
+    with st.expander("全指標の効果量（d_z）"):
+        st.dataframe(effect_sizes(frame).round(3), use_container_width=True)
+    
+    # 行動段階の遷移
+    st.subheader("🔁 行動段階の遷移（行: 実験前 → 列: 実験後）")
+    st.dataframe(stage_progression(frame).round(3), use_container_width=True)
+    matrices = transition_matrices(frame)
+    tabs = st.tabs([group_names[group] for group in matrices])
+    for tab, matrix in zip(tabs, matrices.values()):
+        with tab:
+            st.plotly_chart(
+                px.imshow(matrix, text_auto='.2f', color_continuous_scale='Blues', zmin=0, zmax=1),
+                use_container_width=True
+            )
+    
+    # 操作ログの集計
+    st.subheader("⏱️ 操作ログ（参加者ごとの中央値）")
+    st.dataframe(
+        frame.groupby('experiment_group', observed=False)[
+            ['events', 'control_changes', 'mean_response_time_ms', 'total_dwell_ms']
+        ].median().round(1),
+        use_container_width=True
+    )
+
 def main():
     st.set_page_config(
         page_title="英語学習行動変容研究",
@@ -445,6 +560,11 @@ def main():
     if 'page' not in st.session_state:
         st.session_state.page = "consent"
     
+    # ページ表示を記録（操作イベントはページ遷移時にまとめて書き込む）
+    db_path = get_research().db_path
+    if st.session_state.page != "dashboard":
+        track_page_view(db_path, st.session_state.page)
+    
     # ページルーティング
     if st.session_state.page == "consent":
         show_consent_page()
@@ -454,6 +574,8 @@ def main():
         show_intervention_page()
     elif st.session_state.page == "results":
         show_results_page()
+    elif st.session_state.page == "dashboard":
+        show_dashboard_page()
     
     # 研究者用サイドバー
     with st.sidebar:
@@ -462,7 +584,16 @@ def main():
         if 'experiment_group' in st.session_state:
             st.markdown(f"**実験グループ**: {st.session_state.experiment_group}")
         
+        if st.session_state.page != "dashboard" and st.button("📈 研究者ダッシュボード"):
+            # 参加者のページの滞在を終えてから移り、戻るときはそのページを再表示する
+            st.session_state.dashboard_return_page = st.session_state.page
+            change_page(db_path, "dashboard")
+            st.rerun()
+        
         if st.button("🔄 実験をリセット"):
+            buffer = get_event_buffer(db_path)
+            buffer.page_exit()
+            buffer.flush()
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
             st.rerun()
@@ -0,0 +1,64 @@
+import random
+import secrets
+from database import transaction, fetch_all
+
+CONDITIONS = ["loss_aversion", "social_proof", "implementation_intention"]
+
+
+class StratifiedAssigner:
+    """層別ブロックランダム化による実験群の割り当て
+
+    層（年齢層×職業カテゴリ）ごとに割り当て済み人数をSQLiteのカウンターで管理し、
+    「条件数×block_multiplier」人のブロックごとに各条件が同数になるよう割り当てる。
+    ブロック内の順序は (シード, 層, ブロック番号) から決まるため、保存するのはカウンターだけでよい。
+    """
+
+    def __init__(self, db_path, conditions=CONDITIONS, block_multiplier=2, seed=None):
+        self.db_path = db_path
+        self.conditions = list(conditions)
+        self.block_size = len(self.conditions) * block_multiplier
+        # seed を指定すると割り当て順が再現可能になる（テスト用）
+        self.seed = str(seed) if seed is not None else self._stored_seed()
+
+    def _stored_seed(self):
+        """データベースごとの秘密のシード（初回に生成して保存）"""
+        with transaction(self.db_path) as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO assignment_settings (key, value) VALUES ('seed', ?)",
+                (secrets.token_hex(16),)
+            )
+            return conn.execute("SELECT value FROM assignment_settings WHERE key = 'seed'").fetchone()[0]
+
+    @staticmethod
+    def stratum(age_group, occupation_category):
+        """層のキー"""
+        return f"{age_group}|{occupation_category}"
+
+    def block(self, stratum, block_number):
+        """ブロック内の割り当て順（各条件が同数）"""
+        order = [condition for condition in self.conditions for _ in range(self.block_size // len(self.conditions))]
+        random.Random(f"{self.seed}:{stratum}:{block_number}").shuffle(order)
+        return order
+
+    def assign(self, age_group, occupation_category):
+        """次の参加者の実験群を割り当てる（カウンターの加算は1文で行うため同時実行でも重複しない）"""
+        stratum = self.stratum(age_group, occupation_category)
+        with transaction(self.db_path) as conn:
+            index = conn.execute('''
+                INSERT INTO assignment_counters (stratum, assigned) VALUES (?, 1)
+                ON CONFLICT(stratum) DO UPDATE SET assigned = assigned + 1
+                RETURNING assigned
+            ''', (stratum,)).fetchone()[0] - 1
+            block_number, position = divmod(index, self.block_size)
+            condition = self.block(stratum, block_number)[position]
+            conn.execute('''
+                INSERT INTO assignment_arm_counts (stratum, condition, assigned) VALUES (?, ?, 1)
+                ON CONFLICT(stratum, condition) DO UPDATE SET assigned = assigned + 1
+            ''', (stratum, condition))
+        return condition
+
+    def arm_counts(self):
+        """層×条件ごとの割り当て人数"""
+        return fetch_all(self.db_path, '''
+            SELECT stratum, condition, assigned FROM assignment_arm_counts ORDER BY stratum, condition
+        ''')
@@ -0,0 +1,112 @@
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+import streamlit as st
+from research_store import get_writer
+
+EVENTS_STATE_KEY = '_research_events'
+
+
+def utc_timestamp():
+    """CURRENT_TIMESTAMP と同じ形式（UTC）のミリ秒付きタイムスタンプ"""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+
+class InteractionBuffer:
+    """セッション内の操作イベントをメモリに溜め、ページ遷移時にまとめて書き込む"""
+
+    def __init__(self, db_path, session_id=None):
+        self.db_path = db_path
+        self.session_id = session_id or uuid.uuid4().hex
+        self.events = []
+        self.page = None
+        self.page_entered = None
+        self.last_event = None
+        self.page_interactions = 0
+
+    def page_view(self, page):
+        """ページの表示を記録（同じページの再実行では記録しない）"""
+        if page == self.page:
+            return
+        if self.page is not None:
+            self.page_exit()
+        now = time.perf_counter()
+        self.page = page
+        self.page_entered = now
+        self.last_event = now
+        self.page_interactions = 0
+        self._append('page_view', {'page': page}, None, None)
+
+    def record(self, interaction_type, control=None, value=None):
+        """操作を記録（応答時間は直前のイベントからの経過ミリ秒、エンゲージメントはページ内の操作回数）"""
+        now = time.perf_counter()
+        response_time_ms = int((now - self.last_event) * 1000) if self.last_event is not None else None
+        self.last_event = now
+        self.page_interactions += 1
+        content = {'page': self.page, 'control': control}
+        if value is not None:
+            content['value'] = value
+        self._append(interaction_type, content, response_time_ms, self.page_interactions)
+
+    def page_exit(self):
+        """ページの滞在時間と操作回数を記録"""
+        if self.page is None:
+            return
+        dwell_ms = int((time.perf_counter() - self.page_entered) * 1000)
+        self._append('page_exit', {'page': self.page}, dwell_ms, self.page_interactions)
+        self.page = None
+
+    def _append(self, interaction_type, content, response_time_ms, engagement_score):
+        self.events.append((
+            interaction_type,
+            json.dumps(content, ensure_ascii=False, default=str),
+            response_time_ms,
+            engagement_score,
+            utc_timestamp()
+        ))
+
+    def take(self):
+        """溜まっているイベントを取り出す"""
+        events, self.events = self.events, []
+        return events
+
+    def flush(self):
+        """溜まっているイベントを書き込みスレッドに渡す（1回の executemany で書き込まれる）"""
+        events = self.take()
+        get_writer(self.db_path).submit_events(self.session_id, events)
+        return len(events)
+
+
+def get_event_buffer(db_path):
+    """セッションごとのイベントバッファを取得"""
+    buffer = st.session_state.get(EVENTS_STATE_KEY)
+    if buffer is None:
+        buffer = InteractionBuffer(db_path)
+        st.session_state[EVENTS_STATE_KEY] = buffer
+    return buffer
+
+
+def track_page_view(db_path, page):
+    """ページの表示を記録"""
+    get_event_buffer(db_path).page_view(page)
+
+
+def track_control(db_path, key, interaction_type='control_change'):
+    """ウィジェットの on_change に渡すコールバック（変更後の値を記録）"""
+    def callback():
+        get_event_buffer(db_path).record(interaction_type, key, st.session_state.get(key))
+    return callback
+
+
+def track_click(db_path, control, interaction_type='button_click'):
+    """ボタン操作を記録"""
+    get_event_buffer(db_path).record(interaction_type, control)
+
+
+def change_page(db_path, page):
+    """ページ遷移：現在のページの滞在を記録してまとめて書き込み、遷移先を設定"""
+    buffer = get_event_buffer(db_path)
+    buffer.page_exit()
+    buffer.flush()
+    st.session_state.page = page
@@ -0,0 +1,157 @@
+"""介入メッセージの事前生成バンク
+
+generate_personalized_insight のプロンプトは 年齢層(5)×職業カテゴリ(7)×モチベーション(10)×条件(3)
+= 1,050 通りの入力だけで決まるため、各組み合わせについて複数のバリエーションを事前に生成しておき、
+介入ページではバンクから即座に配信する（未生成の組み合わせのみその場で生成）。
+
+実行例:
+    python research_message_bank.py --variants 3 --concurrency 4
+    python research_message_bank.py --variants 5 --condition social_proof   # 途中から再開しても生成済みは飛ばす
+"""
+import argparse
+import itertools
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from database import execute, fetch_all
+from llm_admission import FallbackText, PRIORITY_BULK
+
+AGE_GROUPS = ["18-24", "25-34", "35-44", "45-54", "55+"]
+OCCUPATION_CATEGORIES = ["学生", "技術職", "事務職", "営業職", "管理職", "専門職", "その他"]
+MOTIVATION_LEVELS = list(range(1, 11))
+CONDITIONS = ["loss_aversion", "social_proof", "implementation_intention"]
+
+# バリエーションを出すためのサンプリング設定
+VARIANT_TEMPERATURE = 0.9
+
+# バンクになく、混雑や障害でその場の生成もできないときに配信する条件ごとの定型メッセージ
+CANNED_MESSAGES = {
+    "loss_aversion": (
+        "英語に触れない期間が長くなるほど、仕事や情報収集で選べる選択肢は少しずつ狭まっていきます。"
+        "一方で、1日10分の学習でも半年続ければ読める資料や話せる相手は確実に増えます。"
+        "今日始めるかどうかが、その差の出発点になります。"
+    ),
+    "social_proof": (
+        "同じ年代・職業の多くの人が、通勤時間やスキマ時間を使って英語学習を続けています。"
+        "特別な才能ではなく、短い時間を習慣にしたことが続けられた人に共通する点です。"
+        "あなたも同じやり方で始めることができます。"
+    ),
+    "implementation_intention": (
+        "「もし朝のコーヒーを飲み終えたら、英語のニュースを1本読む」のように、"
+        "いつ・どこで・何をするかを1つ決めてみましょう。"
+        "忙しい日は「1文だけ読む」と決めておけば、予定が崩れても続けられます。"
+    ),
+}
+
+
+def bank_key(participant_data, condition):
+    """プロンプトを決める入力の組"""
+    return (
+        participant_data.get('age_group'),
+        participant_data.get('occupation_category'),
+        participant_data.get('motivation_level'),
+        condition
+    )
+
+
+class MessageBank:
+    """層×条件ごとに事前生成したメッセージの保存と取り出し"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def pick(self, participant_data, condition, rng=random):
+        """バンクからバリエーションを1つ選ぶ（なければ None）"""
+        rows = fetch_all(self.db_path, '''
+            SELECT id, message FROM message_bank
+            WHERE age_group = ? AND occupation_category = ? AND motivation_level = ? AND condition = ?
+            ORDER BY variant
+        ''', bank_key(participant_data, condition))
+        if not rows:
+            return None
+        variant_id, message = rng.choice(rows)
+        return {'variant_id': variant_id, 'message': message}
+
+    def add(self, key, variant, message, model):
+        """バリエーションを保存（既にあれば何もしない）"""
+        execute(self.db_path, '''
+            INSERT OR IGNORE INTO message_bank
+            (age_group, occupation_category, motivation_level, condition, variant, message, model)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', key + (variant, message, model))
+
+    def existing_variants(self):
+        """生成済みの (キー, バリエーション番号) の集合"""
+        rows = fetch_all(self.db_path, '''
+            SELECT age_group, occupation_category, motivation_level, condition, variant FROM message_bank
+        ''')
+        return {(tuple(row[:4]), row[4]) for row in rows}
+
+
+def all_keys(conditions=CONDITIONS):
+    """全組み合わせ"""
+    return list(itertools.product(AGE_GROUPS, OCCUPATION_CATEGORIES, MOTIVATION_LEVELS, conditions))
+
+
+def build_bank(research, variants, concurrency=4, conditions=CONDITIONS, progress=print):
+    """未生成の (組み合わせ, バリエーション) をまとめて生成して保存"""
+    bank = MessageBank(research.db_path)
+    done = bank.existing_variants()
+    jobs = [
+        (key, variant)
+        for key in all_keys(conditions)
+        for variant in range(variants)
+        if (key, variant) not in done
+    ]
+    progress(f"{len(jobs)}件を生成します（生成済み {len(done)}件）")
+
+    counts = {'saved': 0, 'failed': 0}
+
+    def generate(key, variant):
+        age_group, occupation_category, motivation_level, condition = key
+        # 画面からの生成より後に回す
+        with research.llm.prioritized(PRIORITY_BULK):
+            message = research.generate_personalized_insight(
+                {'age_group': age_group, 'occupation_category': occupation_category, 'motivation_level': motivation_level},
+                condition,
+                temperature=VARIANT_TEMPERATURE,
+                seed=variant
+            )
+        # 生成に失敗したときの定型文はバンクに入れない
+        if not message or isinstance(message, FallbackText):
+            return None
+        return message
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(generate, key, variant): (key, variant) for key, variant in jobs}
+        for future in as_completed(futures):
+            key, variant = futures[future]
+            try:
+                message = future.result()
+            except Exception:
+                message = None
+            if message:
+                bank.add(key, variant, message, research.model)
+                counts['saved'] += 1
+            else:
+                counts['failed'] += 1
+            finished = counts['saved'] + counts['failed']
+            if finished % 50 == 0 or finished == len(jobs):
+                progress(f"{finished}/{len(jobs)} 保存 {counts['saved']} 失敗 {counts['failed']}")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="介入メッセージの事前生成")
+    parser.add_argument('--variants', type=int, default=3, help="組み合わせごとのバリエーション数")
+    parser.add_argument('--concurrency', type=int, default=4, help="同時に生成する数（OLLAMA_NUM_PARALLEL に合わせる）")
+    parser.add_argument('--condition', action='append', choices=CONDITIONS, help="対象の条件（省略時はすべて）")
+    args = parser.parse_args()
+
+    from research_app import BehaviorChangeResearch
+
+    counts = build_bank(BehaviorChangeResearch(), args.variants, args.concurrency, args.condition or CONDITIONS)
+    print(f"完了: 保存 {counts['saved']} 失敗 {counts['failed']}")
+
+
+if __name__ == "__main__":
+    main()
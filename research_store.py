@@ -0,0 +1,250 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from database import transaction
+from metrics import increment
+
+logger = logging.getLogger(__name__)
+
+# ベースライン調査の回答 → 行動変容段階（Transtheoretical Model）
+STAGE_CODES = {
+    "英語学習は考えていない（無関心期）": "precontemplation",
+    "英語学習を考えているが、まだ行動していない（関心期）": "contemplation",
+    "英語学習を始める準備をしている（準備期）": "preparation",
+    "現在英語学習をしている（実行期）": "action",
+    "英語学習を継続している（維持期）": "maintenance",
+}
+
+# 介入後の行動予定 → 行動変容段階（「何も変わらない」はベースラインの段階のまま）
+INTENTION_STAGES = {
+    "英語学習について考えてみる": "contemplation",
+    "具体的な学習方法を調べてみる": "preparation",
+    "今日中に学習を始める": "action",
+    "学習計画を立ててすぐに始める": "action",
+}
+
+INSERT_EVENTS_SQL = '''
+    INSERT INTO interactions
+    (participant_id, session_id, interaction_type, content, response_time_ms, engagement_score, timestamp)
+    VALUES ((SELECT id FROM participants WHERE session_id = ?), ?, ?, ?, ?, ?, ?)
+'''
+
+
+def to_event_rows(session_id, events):
+    """バッファのイベントを INSERT_EVENTS_SQL 用の行に変換（参加者IDは書き込み時に解決）"""
+    return [(session_id, session_id) + tuple(event) for event in events]
+
+
+def write_events(conn, session_id, events):
+    """操作イベントを書き込む"""
+    if events:
+        conn.executemany(INSERT_EVENTS_SQL, to_event_rows(session_id, events))
+
+
+def write_submission(conn, submission):
+    """参加者・ベースライン段階・介入後の段階・結果・未書き込みのイベントを書き込む"""
+    session_id = submission['session_id']
+    participant_data = submission['participant_data']
+    results = submission['results']
+    group = submission['experiment_group']
+
+    cursor = conn.execute('''
+        INSERT INTO participants
+        (session_id, age_group, occupation_category, english_motivation_level, initial_interest_score, experiment_group)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(session_id) DO NOTHING
+    ''', (
+        session_id,
+        participant_data.get('age_group'),
+        participant_data.get('occupation_category'),
+        participant_data.get('motivation_level'),
+        participant_data.get('interest_score'),
+        group
+    ))
+    if cursor.rowcount == 0:
+        # 同じセッションの二重送信
+        return None
+    participant_id = cursor.lastrowid
+
+    baseline_stage = STAGE_CODES.get(participant_data.get('current_stage'))
+    post_stage = INTENTION_STAGES.get(results.get('behavior_intention'), baseline_stage)
+    conn.executemany('''
+        INSERT INTO behavior_stages (participant_id, stage, timestamp, trigger_type, confidence_level)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (participant_id, baseline_stage, submission['baseline_at'], 'baseline', participant_data.get('confidence')),
+        (participant_id, post_stage, submission['submitted_at'], group, None),
+    ])
+
+    conn.execute('''
+        INSERT INTO outcomes
+        (participant_id, motivation_change, interest_change, message_effectiveness,
+         behavior_intention, post_motivation, post_interest, message_variant_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        participant_id,
+        results.get('motivation_change'),
+        results.get('interest_change'),
+        results.get('message_effectiveness'),
+        results.get('behavior_intention'),
+        results.get('post_motivation'),
+        results.get('post_interest'),
+        submission.get('message_variant_id'),
+        submission['submitted_at']
+    ))
+
+    # 参加者の登録前に書き込まれたこのセッションのイベントを紐付ける
+    conn.execute('''
+        UPDATE interactions SET participant_id = ?
+        WHERE session_id = ? AND participant_id IS NULL
+    ''', (participant_id, session_id))
+    write_events(conn, session_id, submission.get('events'))
+    return participant_id
+
+
+class ResearchWriter:
+    """研究データの書き込みを専用スレッドで行う（UIスレッドはキューに積むだけ）
+
+    書き込みに失敗したらバックオフしながら再試行し、それでも失敗した書き込みとキューがあふれた分は
+    追記専用の退避ファイル（JSONL）に書き出す。退避した分はキューが空いたときに書き込み直す。
+    """
+
+    def __init__(self, db_path, max_queue=256, put_timeout=0.05, max_attempts=5, base_delay=0.2, max_delay=5.0,
+                 replay_interval=30.0, dead_letter_path=None):
+        self.db_path = db_path
+        self.put_timeout = put_timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.replay_interval = replay_interval
+        self.dead_letter_path = dead_letter_path or db_path + '.deadletter.jsonl'
+        self._dead_letter_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name='research-writer', daemon=True)
+        self._thread.start()
+
+    def submit_events(self, session_id, events):
+        """操作イベントの書き込みを予約"""
+        if events:
+            self._enqueue(write_events, session_id, list(events))
+
+    def submit_participant(self, submission):
+        """参加者の送信データ一式の書き込みを予約（1トランザクションで書き込む）"""
+        self._enqueue(write_submission, submission)
+
+    def _enqueue(self, func, *args):
+        try:
+            self._queue.put((func, args), timeout=self.put_timeout)
+        except queue.Full:
+            # キューがあふれている場合もUIスレッドでは書き込まず、退避ファイルに追記して後で書き込む
+            increment('research_writer_overflow')
+            self._spill(func, args, 'overflow')
+
+    def _write(self, func, args):
+        with transaction(self.db_path) as conn:
+            func(conn, *args)
+
+    def _write_with_retry(self, func, args):
+        """バックオフしながら書き込む（最後まで失敗したら例外を送出）"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self._write(func, args)
+                return
+            except Exception:
+                if attempt >= self.max_attempts:
+                    raise
+                increment('research_writer_retries', job=func.__name__)
+                time.sleep(min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _run(self):
+        replayed_at = time.monotonic()
+        while True:
+            try:
+                func, args = self._queue.get(timeout=self.replay_interval)
+            except queue.Empty:
+                func = None
+            if func is not None:
+                try:
+                    self._write_with_retry(func, args)
+                except Exception as e:
+                    increment('research_writer_failures', job=func.__name__)
+                    logger.exception("研究データの書き込みに失敗しました（%s を %s に退避）", func.__name__, self.dead_letter_path)
+                    self._spill(func, args, f"{type(e).__name__}: {e}")
+                finally:
+                    self._queue.task_done()
+
+            # 混雑が続いていても一定間隔で退避した分を書き込み直す
+            if time.monotonic() - replayed_at >= self.replay_interval:
+                replayed_at = time.monotonic()
+                try:
+                    self.replay_dead_letters()
+                except Exception:
+                    logger.exception("退避した研究データの読み込みに失敗しました")
+
+    def _spill(self, func, args, reason):
+        """書き込めなかった分を退避ファイルに追記"""
+        line = json.dumps({'job': func.__name__, 'args': args, 'reason': reason, 'spilled_at': time.time()},
+                          ensure_ascii=False, default=str)
+        with self._dead_letter_lock, open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def replay_dead_letters(self):
+        """退避ファイルの分を書き込み直す（失敗した分は退避ファイルに戻す）"""
+        replaying = self.dead_letter_path + '.replaying'
+        with self._dead_letter_lock:
+            if not os.path.exists(replaying):
+                if not os.path.exists(self.dead_letter_path):
+                    return
+                os.replace(self.dead_letter_path, replaying)
+
+        with open(replaying, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        for index, entry in enumerate(entries):
+            func = WRITE_JOBS[entry['job']]
+            try:
+                self._write(func, entry['args'])
+            except Exception:
+                # データベースがまだ使えないので残りは次回に回す
+                logger.exception("退避した研究データの書き込みに失敗しました")
+                for remaining in entries[index:]:
+                    self._spill(WRITE_JOBS[remaining['job']], remaining['args'], remaining['reason'])
+                break
+            increment('research_writer_replayed', job=entry['job'])
+        os.remove(replaying)
+
+    def drain(self):
+        """キューに積まれた書き込みがすべて終わるまで待つ"""
+        self._queue.join()
+
+
+# 退避ファイルから書き込み直すときに使う書き込み処理
+WRITE_JOBS = {func.__name__: func for func in (write_events, write_submission)}
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_path):
+    """データベースファイルに対応するプロセス共通の書き込みスレッドを取得"""
+    writer = _writers.get(db_path)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(db_path)
+            if writer is None:
+                writer = ResearchWriter(db_path)
+                _writers[db_path] = writer
+    return writer
+
+
+@atexit.register
+def drain_writers():
+    """未書き込みのデータをすべて書き切る（プロセス終了時にも呼ばれる）"""
+    for writer in list(_writers.values()):
+        writer.drain()
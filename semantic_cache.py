@@ -0,0 +1,184 @@
+import hashlib
+import threading
+import time
+import numpy as np
+from database import transaction, fetch_all
+from llm_gateway import normalize_text
+from llm_admission import FallbackText
+from metrics import span
+
+
+class HashingEmbedder:
+    """文字n-gramのハッシュによる軽量な埋め込み（モデル不要・CPUのみ）
+
+    語句が1〜2語違うだけの自由記述は、n-gramの大部分が共通するため高いコサイン類似度になる。
+    """
+
+    def __init__(self, dim=1024, ngram_sizes=(2, 3)):
+        self.dim = dim
+        self.ngram_sizes = ngram_sizes
+
+    def _features(self, text):
+        for n in self.ngram_sizes:
+            for i in range(max(len(text) - n + 1, 0)):
+                digest = hashlib.blake2b(text[i:i + n].encode('utf-8'), digest_size=8).digest()
+                value = int.from_bytes(digest, 'little')
+                # 下位ビットで次元、最上位ビットで符号を決める（衝突の偏りを打ち消す）
+                yield value % self.dim, 1.0 if value >> 63 else -1.0
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for index, sign in self._features(text):
+                vectors[row, index] += sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+
+class OllamaEmbedder:
+    """Ollamaの埋め込みモデル（nomic-embed-text など）を使う埋め込み"""
+
+    def __init__(self, model="ollama/nomic-embed-text", api_base="http://localhost:11434"):
+        self.model = model
+        self.api_base = api_base
+
+    def embed(self, texts):
+        from litellm import embedding
+
+        response = embedding(model=self.model, input=list(texts), api_base=self.api_base)
+        vectors = np.array([item['embedding'] for item in response.data], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms > 0, norms, 1.0)
+
+
+class SemanticCache:
+    """プロフィールが似ているユーザーに既存の生成結果を返すキャッシュ
+
+    scope（完全一致が必要な項目）が同じエントリの中で、正規化した自由記述の埋め込みの
+    コサイン類似度が threshold 以上のものがあればその応答を返す。
+    類似度は項目1つが違うだけでも高くなるため、選択肢などの構造化された項目は必ず scope に含める。
+    既定のしきい値は、自由記述の1〜2語の違い（0.95前後）は同一とみなす値。
+    ベクトルはNumPy配列に保持し、SQLiteにも保存して再起動後に読み直す。
+    """
+
+    def __init__(self, namespace, embedder=None, threshold=0.94, max_entries=5000, db_path='llm_cache.db'):
+        self.namespace = namespace
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.init_database()
+        self._load()
+
+    def init_database(self):
+        """テーブルの初期化"""
+        with transaction(self.db_path) as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS semantic_cache (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    namespace TEXT NOT NULL,
+                    scope TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_semantic_cache_namespace ON semantic_cache (namespace, id)'
+            )
+
+    def _load(self):
+        """保存済みのエントリを新しいものから max_entries 件読み込む（次元が最新のものと違う行は除く）"""
+        rows = fetch_all(self.db_path, '''
+            SELECT id, scope, vector, response FROM semantic_cache
+            WHERE namespace = ? ORDER BY id DESC LIMIT ?
+        ''', (self.namespace, self.max_entries))
+        rows = [(row[0], row[1], np.frombuffer(row[2], dtype=np.float32), row[3]) for row in reversed(rows)]
+        if rows:
+            dim = len(rows[-1][2])
+            rows = [row for row in rows if len(row[2]) == dim]
+        self._ids = [row[0] for row in rows]
+        self._scopes = np.array([row[1] for row in rows], dtype=object)
+        self._responses = [row[3] for row in rows]
+        self._vectors = np.vstack([row[2] for row in rows]) if rows else None
+
+    @staticmethod
+    def scope_key(values):
+        """完全一致が必要な項目からスコープのキーを作成"""
+        return hashlib.sha256(repr(values).encode('utf-8')).hexdigest()
+
+    def lookup(self, text, scope=''):
+        """最も類似したエントリの応答を返す（しきい値未満なら None）"""
+        normalized = normalize_text(text)
+        with span('semantic_cache', namespace=self.namespace) as s:
+            vector = self.embedder.embed([normalized])[0]
+            with self._lock:
+                vectors, scopes, responses = self._vectors, self._scopes, list(self._responses)
+            if vectors is None or vectors.shape[1] != len(vector):
+                s.set(hit=0)
+                return None, vector
+
+            similarities = vectors @ vector
+            similarities[scopes != scope] = -1.0
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            hit = similarity >= self.threshold
+            s.set(hit=int(hit), similarity=round(similarity, 4))
+        return (responses[best] if hit else None), vector
+
+    def cached(self, text, generate, scope='', bypass=False):
+        """類似エントリがあればその応答を、なければ生成して保存した応答を返す"""
+        vector = None
+        if not bypass:
+            response, vector = self.lookup(text, scope)
+            if response is not None:
+                return response
+        response = generate()
+        self.add(text, response, scope, vector)
+        return response
+
+    def add(self, text, response, scope='', vector=None):
+        """応答を保存（上限を超えたら古いものから削除）"""
+        if not response or isinstance(response, FallbackText):
+            return
+        if vector is None:
+            vector = self.embedder.embed([normalize_text(text)])[0]
+        vector = np.asarray(vector, dtype=np.float32)
+
+        with transaction(self.db_path) as conn:
+            entry_id = conn.execute('''
+                INSERT INTO semantic_cache (namespace, scope, text, vector, response, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (self.namespace, scope, normalize_text(text), vector.tobytes(), response, time.time())).lastrowid
+            conn.execute('''
+                DELETE FROM semantic_cache WHERE namespace = ? AND id NOT IN (
+                    SELECT id FROM semantic_cache WHERE namespace = ? ORDER BY id DESC LIMIT ?
+                )
+            ''', (self.namespace, self.namespace, self.max_entries))
+
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                self._vectors = vector[np.newaxis, :]
+                self._ids, self._scopes, self._responses = [entry_id], np.array([scope], dtype=object), [response]
+            else:
+                self._vectors = np.vstack([self._vectors, vector])[-self.max_entries:]
+                self._ids = (self._ids + [entry_id])[-self.max_entries:]
+                self._scopes = np.append(self._scopes, np.array([scope], dtype=object))[-self.max_entries:]
+                self._responses = (self._responses + [response])[-self.max_entries:]
+
+    def cached_stream(self, text, chunks_factory, scope='', bypass=False):
+        """類似エントリがあればそれを1回で返し、なければ生成しながら返して完了後に保存する"""
+        vector = None
+        if not bypass:
+            response, vector = self.lookup(text, scope)
+            if response is not None:
+                yield response
+                return
+        parts = []
+        for chunk in chunks_factory():
+            parts.append(chunk)
+            yield chunk
+        if not any(isinstance(part, FallbackText) for part in parts):
+            self.add(text, ''.join(parts), scope, vector)
@@ -0,0 +1,256 @@
+"""EnglishLearningUX を大量のユーザー情報に対して一括実行する
+
+CSV / JSONL のユーザー情報を1件ずつ読み込み、励ましのメッセージと学習ロードマップを
+同時実行数を制限して生成し、結果を JSONL または Parquet に逐次書き出す。
+完了したレコードIDはチェックポイントファイルに記録するため、中断しても同じコマンドで再開できる。
+必須項目がないなど不正な行は失敗として数えて残りの処理を続ける。
+
+入力の列（CSVのヘッダー / JSONLのキー）: id（省略時は行番号）, age, occupation, english_level, goal, interests
+CSVの interests は「,」「、」区切りまたはJSON配列で指定する。
+
+実行例:
+    python struction_batch.py users.csv --output results.jsonl --concurrency 4
+    python struction_batch.py users.jsonl --output results_parquet --format parquet --batch-size 200
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from struction import EnglishLearningUX
+from llm_admission import PRIORITY_BULK
+
+REQUIRED_FIELDS = ('age', 'occupation', 'english_level', 'goal')
+
+
+def read_records(path):
+    """入力ファイルを1件ずつ読み込み (レコードID, ユーザー情報, エラー) を返す（不正な行はユーザー情報が None）"""
+    if path.endswith('.jsonl') or path.endswith('.ndjson'):
+        with open(path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield str(line_number), None, ValueError(f"{line_number}件目: JSONとして読み込めません（{e}）")
+                    continue
+                yield _parse(row, line_number)
+    else:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            for row_number, row in enumerate(csv.DictReader(f), start=1):
+                yield _parse(row, row_number)
+
+
+def _parse(row, number):
+    """入力の1件を変換し、不正な行は読み込み全体を止めずにエラーとして返す"""
+    try:
+        record_id, user_info = _to_user_info(row, number)
+    except (ValueError, TypeError, AttributeError) as e:
+        record_id = str(row.get('id') or number) if isinstance(row, dict) else str(number)
+        return record_id, None, e
+    return record_id, user_info, None
+
+
+def _to_user_info(row, number):
+    """入力の1件を EnglishLearningUX 用のユーザー情報に変換"""
+    missing = [field for field in REQUIRED_FIELDS if not row.get(field)]
+    if missing:
+        raise ValueError(f"{number}件目: {', '.join(missing)} がありません")
+
+    interests = row.get('interests') or []
+    if isinstance(interests, str):
+        text = interests.strip()
+        if text.startswith('['):
+            interests = json.loads(text)
+        else:
+            interests = [item.strip() for item in re.split(r'[,、]', text) if item.strip()]
+
+    age = row['age']
+    if isinstance(age, str) and age.strip().isdigit():
+        age = int(age)
+
+    record_id = str(row.get('id') or number)
+    return record_id, {
+        'age': age,
+        'occupation': row['occupation'],
+        'english_level': row['english_level'],
+        'goal': row['goal'],
+        'interests': interests,
+    }
+
+
+class Checkpoint:
+    """完了したレコードIDの記録（1行1ID、追記のみ）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.done = {line.rstrip('\n') for line in f if line.strip()}
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def mark(self, record_ids):
+        for record_id in record_ids:
+            self._file.write(record_id + '\n')
+            self.done.add(record_id)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter:
+    """結果を1件ずつJSONLに追記"""
+
+    def __init__(self, path, batch_size=1):
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, row):
+        """書き込んで確定したレコードIDを返す"""
+        self._file.write(json.dumps(row, ensure_ascii=False) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return [row['record_id']]
+
+    def close(self):
+        self._file.close()
+        return []
+
+
+class ParquetWriter:
+    """結果を batch_size 件ごとに part-*.parquet としてディレクトリに書き出す"""
+
+    def __init__(self, path, batch_size=200):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet出力には pyarrow が必要です（pip install pyarrow）")
+        self._pa = pa
+        self._pq = pq
+        self.path = path
+        self.batch_size = batch_size
+        self._rows = []
+        os.makedirs(path, exist_ok=True)
+        self._part = len([name for name in os.listdir(path) if name.endswith('.parquet')])
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            return self._flush()
+        return []
+
+    def _flush(self):
+        if not self._rows:
+            return []
+        rows, self._rows = self._rows, []
+        table = self._pa.Table.from_pylist(rows)
+        part_path = os.path.join(self.path, f"part-{self._part:05d}.parquet")
+        # 書き込み途中で落ちても壊れたファイルが残らないよう一時ファイルから置き換える
+        self._pq.write_table(table, part_path + '.tmp')
+        os.replace(part_path + '.tmp', part_path)
+        self._part += 1
+        return [row['record_id'] for row in rows]
+
+    def close(self):
+        return self._flush()
+
+
+def generate(ux, record_id, user_info):
+    """1人分のメッセージとロードマップを生成"""
+    started = time.perf_counter()
+    # 画面からの生成より後に回す
+    with ux.llm.prioritized(PRIORITY_BULK):
+        message = ux.get_personalized_message(user_info)
+        learning_path = ux.generate_learning_path(user_info)
+    return {
+        'record_id': record_id,
+        'user_info': json.dumps(user_info, ensure_ascii=False),
+        'personalized_message': message,
+        'learning_path': learning_path,
+        'model': ux.model,
+        'elapsed_ms': int((time.perf_counter() - started) * 1000),
+    }
+
+
+def run_batch(records, ux, writer, checkpoint, concurrency=4, progress=print):
+    """未完了のレコードを同時実行数を制限して生成し、書き込みとチェックポイントを更新"""
+    counts = {'done': 0, 'skipped': 0, 'failed': 0}
+    # 読み込み済みで未完了のレコードを同時実行数の2倍までに抑え、入力全体をメモリに載せない
+    max_pending = concurrency * 2
+
+    def collect(finished):
+        for future in finished:
+            record_id = pending.pop(future)
+            try:
+                row = future.result()
+            except Exception as e:
+                counts['failed'] += 1
+                progress(f"失敗 {record_id}: {e}")
+                continue
+            checkpoint.mark(writer.write(row))
+            counts['done'] += 1
+            if counts['done'] % 50 == 0:
+                progress(f"完了 {counts['done']} 件（失敗 {counts['failed']} 件）")
+
+    pending = {}
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='struction-batch') as executor:
+            for record_id, user_info, error in records:
+                if record_id in checkpoint.done:
+                    counts['skipped'] += 1
+                    continue
+                if error is not None:
+                    # チェックポイントには記録しないため、入力を直せば再実行時に処理される
+                    counts['failed'] += 1
+                    progress(f"失敗 {record_id}: {error}")
+                    continue
+                if len(pending) >= max_pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                pending[executor.submit(generate, ux, record_id, user_info)] = record_id
+            while pending:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+    finally:
+        # 中断されても書き出し済みの結果を確定させる
+        checkpoint.mark(writer.close())
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EnglishLearningUX の一括生成")
+    parser.add_argument('input', help="ユーザー情報の CSV / JSONL ファイル")
+    parser.add_argument('--output', required=True, help="出力先（jsonl: ファイル、parquet: ディレクトリ）")
+    parser.add_argument('--format', choices=['jsonl', 'parquet'], default=None, help="省略時は出力先の拡張子から判定")
+    parser.add_argument('--concurrency', type=int, default=4, help="同時に処理するユーザー数（OLLAMA_NUM_PARALLEL に合わせる）")
+    parser.add_argument('--batch-size', type=int, default=200, help="Parquetの1ファイルあたりの件数")
+    parser.add_argument('--checkpoint', default=None, help="チェックポイントファイル（省略時は <output>.done）")
+    args = parser.parse_args()
+
+    output_format = args.format or ('jsonl' if args.output.endswith('.jsonl') else 'parquet')
+    writer_class = JsonlWriter if output_format == 'jsonl' else ParquetWriter
+    writer = writer_class(args.output, batch_size=args.batch_size)
+    checkpoint = Checkpoint(args.checkpoint or args.output.rstrip('/') + '.done')
+
+    try:
+        counts = run_batch(
+            read_records(args.input), EnglishLearningUX(), writer, checkpoint,
+            concurrency=args.concurrency,
+            progress=lambda message: print(message, file=sys.stderr)
+        )
+    finally:
+        checkpoint.close()
+    print(f"完了 {counts['done']} 件 / スキップ {counts['skipped']} 件 / 失敗 {counts['failed']} 件")
+    sys.exit(1 if counts['failed'] else 0)
+
+
+if __name__ == "__main__":
+    main()
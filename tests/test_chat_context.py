@@ -0,0 +1,124 @@
+"""チャット履歴の要約が応答を待たせずに一定量ずつ進み、失敗時に再試行を控えることの確認"""
+import time
+from contextlib import nullcontext
+from chat_context import ChatContextManager
+
+
+class FakeLLM:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.prompts = []
+        self.priorities = []
+
+    def prioritized(self, priority):
+        self.priorities.append(priority)
+        return nullcontext()
+
+    def complete(self, messages):
+        self.prompts.append(messages[0]['content'])
+        if self.fail:
+            raise ConnectionError("down")
+        return f"要約{len(self.prompts)}"
+
+
+class FakeApp:
+    model = 'model'
+
+    def __init__(self, count, fail=False):
+        self.rows = [(i, 'user' if i % 2 else 'assistant', f"メッセージ{i}", None) for i in range(1, count + 1)]
+        self.summary = ('', 0)
+        self.llm = FakeLLM(fail)
+
+    def get_chat_history(self, user_id, before_id=None, after_id=None, limit=None):
+        rows = [row for row in self.rows if (before_id is None or row[0] < before_id)]
+        if after_id is not None:
+            rows = [row for row in rows if row[0] > after_id]
+            return rows[:limit] if limit is not None else rows
+        return rows[-limit:] if limit is not None else rows
+
+    def get_chat_summary(self, user_id):
+        return self.summary
+
+    def save_chat_summary(self, user_id, summary, last_message_id):
+        self.summary = (summary, last_message_id)
+
+
+def make_context(app, **options):
+    context = ChatContextManager(app, **options)
+    context.count_tokens = lambda messages: 10 * len(messages)
+    return context
+
+
+def test_build_messages_does_not_call_llm():
+    app = FakeApp(500)
+    app.summary = ("要約", 100)
+    context = make_context(app, recent_turns=2, summarize_batch_turns=3)
+
+    messages = context.build_messages(1, "こんにちは")
+    assert app.llm.prompts == []
+    # 要約＋直前の未要約1バッチ分＋直近の会話＋入力
+    assert messages[0]['content'].endswith("要約")
+    assert [message['content'] for message in messages[1:-1]] == [f"メッセージ{i}" for i in range(491, 501)]
+
+
+def test_backlog_is_folded_in_bounded_batches():
+    app = FakeApp(40)
+    context = make_context(app, recent_turns=2, summarize_batch_turns=3)
+
+    context.fold_pending(1)
+    # 直近の4件より前の36件を6件ずつ
+    assert app.summary == ("要約6", 36)
+    assert "メッセージ6\n" in app.llm.prompts[0] and "メッセージ7\n" not in app.llm.prompts[0]
+    assert app.llm.priorities == ['bulk']
+
+
+def test_batch_is_limited_by_tokens():
+    app = FakeApp(12)
+    context = make_context(app, recent_turns=2, summarize_batch_turns=3, summarize_batch_tokens=25)
+
+    context.fold_pending(1)
+    # 6件たまるたびにトークン数の上限の2件ずつ統合し、残りが6件未満になったら止める
+    assert app.summary == ("要約2", 4)
+
+
+def test_failed_summary_backs_off():
+    app = FakeApp(100, fail=True)
+    context = make_context(app, recent_turns=2, summarize_batch_turns=3)
+
+    for _ in range(3):
+        context.fold_pending(1)
+    assert len(app.llm.prompts) == 1
+    assert app.summary == ('', 0)
+
+
+def test_history_is_trimmed_to_token_budget():
+    app = FakeApp(20)
+    app.summary = ("要約", 10)
+    context = make_context(app, recent_turns=2, summarize_batch_turns=3, token_budget=60)
+    calls = []
+    count_tokens = context.count_tokens
+    context.count_tokens = lambda messages: calls.append(messages) or count_tokens(messages)
+
+    messages = context.build_messages(1, "こんにちは")
+    # 要約＋入力で20、残りの40に収まる直近の4件だけを残す
+    assert [message['content'] for message in messages[1:-1]] == [f"メッセージ{i}" for i in range(17, 21)]
+    assert len(calls) == 1 + 10
+
+
+def test_background_fold_only_starts_when_batch_is_pending():
+    # 直近の4件より前は4件だけで、1バッチ（6件）に満たない
+    app = FakeApp(8)
+    context = make_context(app, recent_turns=2, summarize_batch_turns=3)
+    context.build_messages(1, "こんにちは")
+    context.fold_pending_in_background(1)
+    assert 1 not in context._folding and app.llm.prompts == []
+
+    app = FakeApp(40)
+    context = make_context(app, recent_turns=2, summarize_batch_turns=3)
+    context.build_messages(1, "こんにちは")
+    context.fold_pending_in_background(1)
+    for _ in range(100):
+        if 1 not in context._folding:
+            break
+        time.sleep(0.01)
+    assert app.summary == ("要約6", 36)
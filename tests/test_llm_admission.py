@@ -0,0 +1,43 @@
+"""待ち行列で待っている呼び出しが中断されたときに枠・順番が残らないことの確認"""
+import pytest
+from llm_admission import AdmissionController, waiting_feedback
+
+
+class Interrupted(BaseException):
+    """Streamlit の StopException など、Exception を継承しない中断"""
+
+
+def interrupt(position, estimated):
+    raise Interrupted()
+
+
+def test_interrupted_waiter_leaves_queue():
+    controller = AdmissionController(max_in_flight=1, poll_interval=0.01)
+    controller._acquire('interactive')
+
+    with waiting_feedback(interrupt), pytest.raises(Interrupted):
+        controller._acquire('interactive')
+    assert controller.status()['waiting'] == 0
+    assert controller._queue == []
+
+    controller._release(0.1)
+    assert controller.status()['in_flight'] == 0
+    with controller.admit('chat'):
+        assert controller.status()['in_flight'] == 1
+    assert controller.status()['in_flight'] == 0
+
+
+def test_interrupted_after_grant_releases_slot():
+    controller = AdmissionController(max_in_flight=1, poll_interval=0.01)
+    controller._acquire('interactive')
+
+    def release_then_interrupt(position, estimated):
+        # 順番が回ってきた直後に中断される
+        controller._release(0.1)
+        raise Interrupted()
+
+    with waiting_feedback(release_then_interrupt), pytest.raises(Interrupted):
+        controller._acquire('interactive')
+    assert controller.status() == {'in_flight': 0, 'waiting': 0, 'max_in_flight': 1, 'service_time': 0.1}
+    with controller.admit('chat'):
+        assert controller.status()['in_flight'] == 1
@@ -0,0 +1,56 @@
+"""応答キャッシュの有効期限切れとLRU上限での削除の確認"""
+import time
+from types import SimpleNamespace
+import pytest
+import llm_gateway
+from llm_gateway import LLMCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(llm_gateway, 'time', SimpleNamespace(time=clock.time, monotonic=time.monotonic))
+    return clock
+
+
+def test_entry_expires_after_ttl(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / 'cache.db'), ttl_seconds=60)
+    cache.set('key', 'model', '応答')
+
+    clock.now += 59
+    assert cache.get('key') == '応答'
+    clock.now += 2
+    assert cache.get('key') is None
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'entries': 0}
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path, clock):
+    cache = LLMCache(str(tmp_path / 'cache.db'), max_entries=2)
+    cache.set('a', 'model', 'A')
+    clock.now += 1
+    cache.set('b', 'model', 'B')
+    clock.now += 1
+    # a を参照すると、最も長く使われていないのは b になる
+    assert cache.get('a') == 'A'
+    clock.now += 1
+    cache.set('c', 'model', 'C')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A'
+    assert cache.get('c') == 'C'
+    assert cache.stats()['entries'] == 2
+
+
+def test_key_ignores_whitespace_and_unicode_width():
+    messages = [{"role": "user", "content": "  ＡＢＣ  \n  次の行 "}]
+    normalized = [{"role": "user", "content": "ABC\n次の行"}]
+    assert LLMCache.make_key('model', messages) == LLMCache.make_key('model', normalized)
+    assert LLMCache.make_key('model', messages) != LLMCache.make_key('model', messages, {'temperature': 0})
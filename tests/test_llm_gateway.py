@@ -0,0 +1,61 @@
+"""バックエンドの空き待ち・ストリーミングの受信が呼び出しの期限で打ち切られることの確認"""
+import time
+from types import SimpleNamespace
+import pytest
+import llm_gateway
+from llm_gateway import LLMGateway
+from llm_router import Backend, BackendRouter, NoBackendAvailable
+from llm_resilience import DeadlineExceeded
+
+
+@pytest.fixture
+def gateway(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    router = BackendRouter([Backend('http://backend:11434', max_concurrency=1)], health_check_interval=0)
+    gateway = LLMGateway(router=router, config={'retry': {'max_attempts': 1}})
+    gateway.cache = None
+    return gateway
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+
+
+def test_backend_wait_is_bounded_by_request_timeout(gateway):
+    gateway.router.acquire()
+    started = time.monotonic()
+    with pytest.raises(NoBackendAvailable):
+        gateway.complete([{"role": "user", "content": "hi"}], timeout=0.3)
+    assert time.monotonic() - started < 2
+
+
+def test_long_streams_do_not_mark_backend_down(gateway, monkeypatch):
+    def slow_stream(**kwargs):
+        for i in range(10):
+            time.sleep(0.05)
+            yield chunk(str(i))
+
+    monkeypatch.setattr(llm_gateway, 'completion', lambda **kwargs: slow_stream(**kwargs))
+    gateway.breaker.failure_threshold = 1
+    gateway.router.failure_threshold = 1
+    for _ in range(3):
+        # 応答全体は期限の0.3秒より長いが、チャンク間は短い
+        text = ''.join(gateway.stream([{"role": "user", "content": "hi"}], timeout=0.3))
+        assert text == ''.join(str(i) for i in range(10))
+    assert gateway.router.status()[0]['healthy']
+    assert gateway.router.status()[0]['outstanding'] == 0
+    assert gateway.breaker.state == gateway.breaker.CLOSED
+
+
+def test_stream_without_first_token_stops_at_deadline(gateway, monkeypatch):
+    def silent_stream(**kwargs):
+        for _ in range(50):
+            time.sleep(0.05)
+            yield chunk(None)
+
+    monkeypatch.setattr(llm_gateway, 'completion', lambda **kwargs: silent_stream(**kwargs))
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        list(gateway.stream([{"role": "user", "content": "hi"}], timeout=0.3))
+    assert time.monotonic() - started < 1
+    assert gateway.router.status()[0]['outstanding'] == 0
@@ -0,0 +1,70 @@
+"""バックエンドの振り分け（処理中の少ない順）と、失敗が続いたバックエンドを一時的に外す動作の確認"""
+import threading
+import time
+import pytest
+from llm_router import Backend, BackendRouter, NoBackendAvailable, from_config
+
+
+def make_router(*capacities, **options):
+    backends = [Backend(f"http://node-{i}:11434", capacity) for i, capacity in enumerate(capacities)]
+    return BackendRouter(backends, health_check_interval=0, **options)
+
+
+def test_least_outstanding_backend_is_selected():
+    router = make_router(4, 2)
+    chosen = [router.acquire().api_base for _ in range(6)]
+    # 上限に対する処理中の割合が低い方へ交互に振り分け、上限まで使い切る
+    assert sorted(chosen) == ["http://node-0:11434"] * 4 + ["http://node-1:11434"] * 2
+    assert chosen[:2] == ["http://node-0:11434", "http://node-1:11434"]
+    with pytest.raises(NoBackendAvailable):
+        router.acquire(timeout=0.05)
+
+
+def test_released_capacity_is_reused_by_waiter():
+    router = make_router(1)
+    backend = router.acquire()
+    started = time.monotonic()
+    threading.Timer(0.1, router.release, args=(backend,)).start()
+    assert router.acquire(timeout=2) is backend
+    assert time.monotonic() - started < 1.5
+
+
+def test_failing_backend_is_marked_down_until_cooldown():
+    router = make_router(2, 2, failure_threshold=2, cooldown=0.2)
+    bad, good = router.backends
+    for _ in range(2):
+        # bad に送ったリクエストがサーバー側の障害で失敗した
+        bad.outstanding += 1
+        router.release(bad, failed=True)
+    assert not bad.healthy
+
+    # 停止中のバックエンドには送らない
+    assert {router.acquire().api_base for _ in range(2)} == {good.api_base}
+    with pytest.raises(NoBackendAvailable):
+        router.acquire(timeout=0.05)
+
+    # cooldown が過ぎたら再び試し、成功すれば復帰する
+    time.sleep(0.25)
+    trial = router.acquire()
+    assert trial is bad
+    router.release(trial)
+    assert bad.healthy and bad.failures == 0
+
+
+def test_all_backends_down_fails_fast():
+    router = make_router(1, failure_threshold=1, cooldown=60)
+    router.release(router.acquire(), failed=True)
+    started = time.monotonic()
+    with pytest.raises(NoBackendAvailable):
+        router.acquire(timeout=5)
+    assert time.monotonic() - started < 0.5
+
+
+def test_from_config_reads_backends_and_options():
+    router = from_config({
+        'model': 'ollama/test',
+        'backends': ["http://a:11434/", {'api_base': "http://b:11434", 'max_concurrency': 2}],
+        'cooldown': 5,
+    })
+    assert [(b.api_base, b.max_concurrency) for b in router.backends] == [("http://a:11434", 4), ("http://b:11434", 2)]
+    assert router.capacity() == 6 and router.cooldown == 5 and router.model == 'ollama/test'
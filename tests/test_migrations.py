@@ -0,0 +1,30 @@
+"""各スキーマのマイグレーションを空DBに適用し、頻出クエリがインデックスを使うこと・再適用できることの確認"""
+import pytest
+import migrations
+from database import fetch_all
+from migrations import SCHEMAS, run_migrations, check_query_plans
+
+
+def schema_snapshot(db_path):
+    return fetch_all(db_path, "SELECT type, name, sql FROM sqlite_master WHERE name != 'sqlite_sequence' ORDER BY name")
+
+
+@pytest.mark.parametrize('schema', sorted(SCHEMAS))
+def test_query_plans_use_indexes(tmp_path, schema):
+    db_path = str(tmp_path / f"{schema}.db")
+    run_migrations(db_path, schema)
+    assert check_query_plans(db_path, schema) == []
+
+
+@pytest.mark.parametrize('schema', sorted(SCHEMAS))
+def test_migrations_are_idempotent(tmp_path, schema):
+    db_path = str(tmp_path / f"{schema}.db")
+    run_migrations(db_path, schema)
+    snapshot = schema_snapshot(db_path)
+
+    # 別プロセスからの起動と同じく、プロセス内の適用済みの記録を消してもう一度適用する
+    migrations._migrated.discard((db_path, schema))
+    run_migrations(db_path, schema)
+    assert schema_snapshot(db_path) == snapshot
+    versions = fetch_all(db_path, 'SELECT version FROM schema_version ORDER BY version')
+    assert versions == [(version,) for version, _, _ in SCHEMAS[schema]]
@@ -0,0 +1,51 @@
+"""層別ブロックランダム化の再現性・ブロック内の均等性・同時実行時のカウンターの確認"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from database import fetch_all
+from migrations import run_migrations
+from research_assignment import StratifiedAssigner, CONDITIONS
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'research.db')
+    run_migrations(path, 'behavior_research')
+    return path
+
+
+def test_fixed_seed_gives_same_sequence(tmp_path):
+    sequences = []
+    for name in ('a.db', 'b.db'):
+        path = str(tmp_path / name)
+        run_migrations(path, 'behavior_research')
+        assigner = StratifiedAssigner(path, seed=42)
+        sequences.append([assigner.assign('25-34', '技術職') for _ in range(20)])
+    assert sequences[0] == sequences[1]
+    assert StratifiedAssigner(str(tmp_path / 'a.db'), seed=7).block('25-34|技術職', 0) != \
+        StratifiedAssigner(str(tmp_path / 'a.db'), seed=42).block('25-34|技術職', 0)
+
+
+def test_each_completed_block_is_balanced_per_stratum(db_path):
+    assigner = StratifiedAssigner(db_path, seed=1)
+    strata = [('25-34', '技術職'), ('35-44', '営業職')]
+    assigned = {stratum: [assigner.assign(*stratum) for _ in range(assigner.block_size * 3)] for stratum in strata}
+
+    per_condition = assigner.block_size // len(CONDITIONS)
+    for sequence in assigned.values():
+        for start in range(0, len(sequence), assigner.block_size):
+            block = Counter(sequence[start:start + assigner.block_size])
+            assert block == {condition: per_condition for condition in CONDITIONS}
+
+
+def test_concurrent_assignments_take_distinct_positions(db_path):
+    assigner = StratifiedAssigner(db_path, seed=1)
+    count = assigner.block_size * 4
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        conditions = list(executor.map(lambda _: assigner.assign('25-34', '技術職'), range(count)))
+
+    # 位置が重複・欠落していなければ、完了したブロックの分だけ各条件が同数になる
+    assert fetch_all(db_path, 'SELECT assigned FROM assignment_counters') == [(count,)]
+    assert Counter(conditions) == {condition: count // len(CONDITIONS) for condition in CONDITIONS}
+    assert sorted(row[1:] for row in assigner.arm_counts()) == [(c, count // len(CONDITIONS)) for c in sorted(CONDITIONS)]
@@ -0,0 +1,92 @@
+"""研究データの書き込みが失敗・あふれたときに失われず、UIスレッドで書き込まないことの確認"""
+import json
+import threading
+import time
+import pytest
+from database import fetch_all
+from migrations import run_migrations
+from research_store import ResearchWriter
+
+SUBMISSION = {
+    'session_id': 's1',
+    'participant_data': {'age_group': '25-34', 'current_stage': None},
+    'experiment_group': 'control',
+    'results': {'behavior_intention': '何も変わらない'},
+    'message_variant_id': None,
+    'baseline_at': '2026-01-01T00:00:00Z',
+    'submitted_at': '2026-01-01T00:05:00Z',
+    'events': [['page_view', 'consent', None, None, '2026-01-01T00:00:01Z']],
+}
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'research.db')
+    run_migrations(path, 'behavior_research')
+    return path
+
+
+def participants(db_path):
+    return fetch_all(db_path, 'SELECT session_id FROM participants')
+
+
+def test_transient_failure_is_retried(db_path, monkeypatch):
+    writer = ResearchWriter(db_path, base_delay=0.01)
+    write = writer._write
+    failures = []
+
+    def flaky(func, args):
+        if len(failures) < 2:
+            failures.append(1)
+            raise RuntimeError("database is locked")
+        write(func, args)
+
+    monkeypatch.setattr(writer, '_write', flaky)
+    writer.submit_participant(SUBMISSION)
+    writer.drain()
+    assert participants(db_path) == [('s1',)]
+
+
+def test_failed_write_is_spilled_and_replayed(db_path, monkeypatch):
+    writer = ResearchWriter(db_path, max_attempts=2, base_delay=0.01)
+    write = writer._write
+    monkeypatch.setattr(writer, '_write', lambda func, args: (_ for _ in ()).throw(RuntimeError("locked")))
+    writer.submit_participant(SUBMISSION)
+    writer.drain()
+    assert participants(db_path) == []
+    with open(writer.dead_letter_path, encoding='utf-8') as f:
+        assert json.loads(f.readline())['job'] == 'write_submission'
+
+    monkeypatch.setattr(writer, '_write', write)
+    writer.replay_dead_letters()
+    assert participants(db_path) == [('s1',)]
+    assert fetch_all(db_path, 'SELECT participant_id IS NOT NULL FROM interactions') == [(1,)]
+
+
+def test_overflow_is_spilled_without_writing_on_caller_thread(db_path, monkeypatch):
+    writer = ResearchWriter(db_path, max_queue=1, put_timeout=0.01)
+    release = threading.Event()
+    write = writer._write
+    callers = []
+
+    def blocking(func, args):
+        callers.append(threading.current_thread().name)
+        release.wait()
+        write(func, args)
+
+    monkeypatch.setattr(writer, '_write', blocking)
+    writer.submit_participant(dict(SUBMISSION, session_id="s0"))
+    while not callers:
+        time.sleep(0.01)
+    # 1件は書き込み中、1件はキュー、3件目はあふれる
+    writer.submit_participant(dict(SUBMISSION, session_id="s1"))
+    writer.submit_participant(dict(SUBMISSION, session_id="s2"))
+    with open(writer.dead_letter_path, encoding='utf-8') as f:
+        assert [json.loads(line)['reason'] for line in f] == ['overflow']
+
+    release.set()
+    writer.drain()
+    assert callers == ['research-writer', 'research-writer']
+    monkeypatch.setattr(writer, '_write', write)
+    writer.replay_dead_letters()
+    assert sorted(participants(db_path)) == [('s0',), ('s1',), ('s2',)]
@@ -0,0 +1,51 @@
+"""構造化された項目が違うプロフィールに他のユーザーの生成結果を返さないことの確認"""
+import pytest
+from prompts import get_template
+from semantic_cache import SemanticCache
+
+TEMPLATE = 'motivation_focus.next_step_guidance'
+
+PROFILE = {
+    'age_group': '30代',
+    'occupation': '会社員',
+    'english_frequency': 'ほとんど使わない',
+    'past_experience': ['学校の授業のみ'],
+    'personality_traits': ['計画的'],
+    'time_availability': '1日15-30分',
+    'stress_factors': ['仕事が忙しい'],
+    'interest_level': 5,
+    'concerns': '何から始めればいいかわからない',
+    'dream': '海外旅行で現地の人と英語で会話したい',
+}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SemanticCache('test', db_path=str(tmp_path / 'cache.db'))
+
+
+def key(user_data):
+    profile = get_template(TEMPLATE).profile
+    scope = SemanticCache.scope_key((TEMPLATE, 'model') + profile.structured_values(user_data))
+    return profile.values_text(user_data), scope
+
+
+@pytest.mark.parametrize('field, value', [
+    ('occupation', '学生'),
+    ('english_frequency', '毎日使う'),
+    ('personality_traits', ['慎重']),
+    ('time_availability', '1日5分未満'),
+    ('interest_level', 6),
+])
+def test_different_structured_field_is_not_shared(cache, field, value):
+    text, scope = key(PROFILE)
+    cache.add(text, 'A', scope)
+    response, _ = cache.lookup(*key(dict(PROFILE, **{field: value})))
+    assert response is None
+
+
+def test_similar_free_text_is_shared(cache):
+    text, scope = key(PROFILE)
+    cache.add(text, 'A', scope)
+    response, _ = cache.lookup(*key(dict(PROFILE, dream='海外旅行で現地の人と英語で会話したいです')))
+    assert response == 'A'
@@ -0,0 +1,80 @@
+"""不正な入力行があっても一括生成を続け、書き出し済みの結果をチェックポイントに記録することの確認"""
+import json
+import pytest
+from struction_batch import read_records, run_batch, Checkpoint, JsonlWriter
+
+USER = {'age': '30', 'occupation': 'エンジニア', 'english_level': '初級', 'goal': 'TOEIC 800点', 'interests': 'IT、旅行'}
+
+
+class FakeUX:
+    model = 'model'
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.llm = self
+
+    def prioritized(self, priority):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def get_personalized_message(self, user_info):
+        if user_info['goal'] == self.fail_on:
+            raise KeyboardInterrupt()
+        return "メッセージ"
+
+    def generate_learning_path(self, user_info):
+        return "ロードマップ"
+
+
+def write_input(tmp_path, rows):
+    path = tmp_path / 'users.jsonl'
+    path.write_text('\n'.join(row if isinstance(row, str) else json.dumps(row, ensure_ascii=False) for row in rows),
+                    encoding='utf-8')
+    return str(path)
+
+
+def test_malformed_rows_are_counted_as_failed(tmp_path):
+    path = write_input(tmp_path, [
+        dict(USER, id='a'),
+        '{not json',
+        dict(USER, id='b', goal=''),
+        dict(USER, id='c', interests='[broken'),
+        dict(USER, id='d'),
+    ])
+    checkpoint = Checkpoint(str(tmp_path / 'out.done'))
+    messages = []
+
+    counts = run_batch(read_records(path), FakeUX(), JsonlWriter(str(tmp_path / 'out.jsonl')), checkpoint,
+                       concurrency=2, progress=messages.append)
+    assert counts == {'done': 2, 'skipped': 0, 'failed': 3}
+    assert checkpoint.done == {'a', 'd'}
+    assert [message.split(':')[0] for message in messages] == ['失敗 2', '失敗 b', '失敗 c']
+
+
+def test_writer_is_closed_when_interrupted(tmp_path):
+    path = write_input(tmp_path, [dict(USER, id=str(i)) for i in range(3)] + [dict(USER, id='stop', goal='stop')])
+    checkpoint = Checkpoint(str(tmp_path / 'out.done'))
+
+    class BufferedWriter(JsonlWriter):
+        """close するまで確定しない書き込み"""
+        def __init__(self, path):
+            super().__init__(path)
+            self.buffered = []
+
+        def write(self, row):
+            self.buffered.append(row['record_id'])
+            return []
+
+        def close(self):
+            super().close()
+            return self.buffered
+
+    with pytest.raises(KeyboardInterrupt):
+        run_batch(read_records(path), FakeUX(fail_on='stop'), BufferedWriter(str(tmp_path / 'out.jsonl')),
+                  checkpoint, concurrency=1, progress=lambda message: None)
+    assert checkpoint.done == {'0', '1', '2'}